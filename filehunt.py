@@ -6,13 +6,47 @@
 # filehunt: general file searching library for use by PANhunt and PassHunt
 # By BB
 
-import os, sys, zipfile, re, datetime, cStringIO, argparse, time, hashlib, unicodedata, codecs
+import os, sys, zipfile, re, datetime, cStringIO, argparse, time, hashlib, unicodedata, codecs, mmap, multiprocessing, threading, Queue, collections, fnmatch, copy, gzip, traceback
+import multiprocessing.pool, multiprocessing.managers
+import cPickle as pickle
+try:
+    import scandir # optional, for a faster directory walk
+except ImportError:
+    scandir = None
+try:
+    import psutil # optional, to measure memory use where there's no /proc
+except ImportError:
+    psutil = None
 import colorama
 import progressbar
 import pst # MS-PST files
 import msmsg # MS-MSG files
 
-TEXT_FILE_SIZE_LIMIT = 1073741824 # 1Gb
+TEXT_FILE_SIZE_LIMIT = 1073741824 # 1Gb, SPECIAL files over this size are listed but not checked
+TEXT_FILE_CHUNK_SIZE = 16777216 # 16Mb, TEXT files are read and checked in chunks of this size
+TEXT_FILE_CHUNK_OVERLAP = 4096 # the end of a chunk after its last split point (up to this size) is carried into the next chunk
+WALK_QUEUE_SIZE = 10000 # files found by the walker thread that can wait to be checked before the walk pauses
+PST_MESSAGE_BATCH_SIZE = 100 # messages per part when a PST is split for the pool of worker processes
+ZIP_MEMBER_BATCH_SIZE = 16777216 # 16Mb, uncompressed bytes of documents per work unit when a ZIP is checked by a pool
+POOL_TASKS_PER_WORKER = 2 # tasks queued in the process pool per worker, the rest wait to be scheduled largest first
+FILE_TYPE_COSTS = {'MAIL': 4, 'ZIP': 2, 'SPECIAL': 2, 'GZIP': 2, 'TEXT': 1} # relative cost per byte of checking each file type
+PREFETCH_FILES_PER_REQUEST = 2 # files read ahead of the checks per I/O request in flight, whatever their size
+DIRECTORY_WORK_UNIT_DEPTH = 2 # levels of sub directories a coordinator splits into separate work units
+DIRECTORY_WORK_HEARTBEAT_INTERVAL = 5 # seconds between a worker's heartbeats for its work unit, and its checks for units put back
+DIRECTORY_WORK_UNIT_TIMEOUT = 60 # seconds without a heartbeat after which a work unit is put back for another worker
+DIRECTORY_WORK_UNIT_ATTEMPTS = 3 # times a work unit can fail in a worker before the coordinator gives up on the hunt
+GOVERNOR_BURST_TIME = 0.1 # seconds of a governor's rate that can be used at once after it has been idle
+GOVERNOR_MIN_READ_SIZE = 65536 # smallest read when reads are throttled, bigger than TEXT_FILE_CHUNK_OVERLAP
+MEMORY_CHECK_INTERVAL = 0.5 # seconds between measures of a process pool's memory use when it has a memory limit
+MEMORY_LOW_WATER = 0.75 # share of the memory limit a process pool's memory use must fall under to start more tasks at once
+MEMORY_LIMIT_TASKS_PER_WORKER = 100 # tasks after which a worker process is replaced when there's a memory limit
+DIRECTORY_ENTRY_STATS = os.name == 'nt' # directory entries come with the file's stats, which saves a stat per file
+DIRECTORY_LISTINGS_PER_THREAD = 4 # directories listed ahead of the walk per I/O thread
+FILE_MAGIC_SIZE = 8 # bytes read from the start of a file to sniff its type
+FILE_MAGIC_TYPES = (('!BDN', 'MAIL'), ('PK\x03\x04', 'ZIP'), ('\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'SPECIAL'), ('\x1f\x8b', 'GZIP'), \
+                ('\x7fELF', 'BINARY'), ('MZ\x90\x00', 'BINARY'), ('\xca\xfe\xba\xbe', 'BINARY'), ('\xcf\xfa\xed\xfe', 'BINARY'), \
+                ('\x89PNG', 'BINARY'), ('\xff\xd8\xff', 'BINARY'), ('GIF8', 'BINARY'), ('OggS', 'BINARY'), ('ID3', 'BINARY'), \
+                ('fLaC', 'BINARY'), ('Rar!', 'BINARY'), ('7z\xbc\xaf\x27\x1c', 'BINARY')) # magic bytes and the file type they tell
 
 ###################################################################################################################################
 #   ____ _                         
@@ -24,37 +58,107 @@ TEXT_FILE_SIZE_LIMIT = 1073741824 # 1Gb
 ###################################################################################################################################
 
 
-class AFile:
+class AFile(object):
     """ AFile: class for a file that can search itself"""
 
+    # slots rather than a __dict__, as an AFile is kept for every file found until the report is written
+    __slots__ = ('filename', 'dir', 'ext', 'errors', 'type', 'matches', 'size', 'accessed_ts', 'modified_ts', 'created_ts', 'file_id', 'alias_of')
+    result_slots = ('errors', 'matches') # the slots checking a file sets, copied back by update from another process
+
     def __init__(self, filename, file_dir):
         
         self.filename = filename
-        self.dir = file_dir
-        self.path = os.path.join(self.dir, self.filename)
-        self.root, self.ext = os.path.splitext(self.filename)
-        self.errors = []
+        self.dir = intern_text(file_dir)
+        self.ext = intern_text(os.path.splitext(self.filename)[1])
+        self.errors = () # lists are only created on the first error or match, the empty tuple is shared
         self.type = None
-        self.matches = []
+        self.matches = ()
 
     def __cmp__(self, other):
     
         return cmp(self.path.lower(), other.path.lower())
 
 
-    def set_file_stats(self):
+    @property
+    def path(self):
+
+        return os.path.join(self.dir, self.filename)
+
+
+    @property
+    def root(self):
+
+        return os.path.splitext(self.filename)[0]
+
+
+    @property
+    def accessed(self):
+
+        return self.dtm_from_ts(self.accessed_ts)
+
+
+    @property
+    def modified(self):
+
+        return self.dtm_from_ts(self.modified_ts)
+
+
+    @property
+    def created(self):
+
+        return self.dtm_from_ts(self.created_ts)
+
+
+    def update(self, checked_afile):
+        """copies the results of checking this file in another process from checked_afile"""
+
+        for slot in self.result_slots:
+            setattr(self, slot, getattr(checked_afile, slot))
+
+
+    def merge(self, checked_afile):
+        """adds the matches and errors from checking part of this file in another process, in the order the parts are merged"""
+
+        for match in checked_afile.matches:
+            self.merge_match(match)
+        if checked_afile.errors:
+            if not self.errors:
+                self.errors = []
+            self.errors.extend(checked_afile.errors)
+
+
+    def merge_match(self, match):
+
+        if not self.matches:
+            self.matches = []
+        self.matches.append(match)
+
+
+    def set_file_stats(self, stat=None):
+        """sets the size and dates from stat, e.g. from a directory entry, or else a stat of the file. Returns the stat, or 
+        None if the file couldn't be stat'd"""
 
         try:
-            stat = os.stat(self.path)
+            if not stat:
+                stat = os.stat(self.path)
             self.size = stat.st_size
-            self.accessed = self.dtm_from_ts(stat.st_atime)
-            self.modified = self.dtm_from_ts(stat.st_mtime)
-            self.created = self.dtm_from_ts(stat.st_ctime)
+            self.accessed_ts = stat.st_atime
+            self.modified_ts = stat.st_mtime
+            self.created_ts = stat.st_ctime
+            return stat
         except: # WindowsError:
             self.size = -1
             self.set_error(sys.exc_info()[1])            
             
 
+    def set_alias(self, path):
+        """makes this file an alias of the same file found at path, which is checked instead"""
+
+        self.type = 'ALIAS'
+        self.alias_of = path
+        self.matches = ()
+
+
     def dtm_from_ts(self, ts):
         
         try:
@@ -73,17 +177,24 @@ class AFile:
 
     def set_error(self, error_msg):
 
+        if not self.errors:
+            self.errors = []
         self.errors.append(error_msg)
         print colorama.Fore.RED + unicode2ascii(u'ERROR %s on %s' % (error_msg, self.path)) + colorama.Fore.WHITE
 
 
-    def check_regexs(self, regexs, search_extensions):
-        """Checks the file for matching regular expressions: if a ZIP then each file in the ZIP (recursively) or the text in a document"""
+    def check_regexs(self, regexs, search_extensions, data=None):
+        """Checks the file for matching regular expressions: if a ZIP then each file in the ZIP (recursively) or the text in a document.
+        data is the file's contents if already read, e.g. by prefetch_files"""
+
+        if governor:
+            governor.use_file()
 
         if self.type == 'ZIP':
             try:
-                if zipfile.is_zipfile(self.path):
-                    zf = zipfile.ZipFile(self.path)
+                zip_file = get_readable_file(self.path) if data is None else cStringIO.StringIO(data)
+                if zipfile.is_zipfile(zip_file):
+                    zf = zipfile.ZipFile(zip_file)
                     self.check_zip_regexs(zf, regexs, search_extensions, '')                                             
                 else:
                     self.set_error('Invalid ZIP file')
@@ -94,8 +205,10 @@ class AFile:
 
         elif self.type == 'TEXT':
             try:
-                file_text = read_file(self.path, 'rb')
-                self.check_text_regexs(file_text, regexs, '')
+                if data is None:
+                    self.check_text_file_regexs(regexs)
+                else:
+                    self.check_text_regexs(data, regexs, '')
             #except WindowsError:
             #    self.set_error(sys.exc_info()[1])
             except IOError:
@@ -103,10 +216,22 @@ class AFile:
             except:
                 self.set_error(sys.exc_info()[1])
 
+        elif self.type == 'GZIP':
+            try:
+                gzip_file = gzip.GzipFile(self.path, 'rb') if data is None else gzip.GzipFile(fileobj=cStringIO.StringIO(data), mode='rb')
+                try:
+                    self.check_text_chunks_regexs(gzip_file, regexs)
+                finally:
+                    gzip_file.close()
+            except:
+                self.set_error(sys.exc_info()[1])
+
         elif self.type == 'SPECIAL':
-            if get_ext(self.path) == '.msg':
+            if get_ext(self.path) not in search_extensions['SPECIAL']: # a compound file found by sniff_file_type
+                self.check_compound_file_regexs(regexs, search_extensions, data)
+            elif get_ext(self.path) == '.msg':
                 try:
-                    msg = msmsg.MSMSG(self.path)
+                    msg = msmsg.MSMSG(get_readable_file(self.path) if data is None else cStringIO.StringIO(data))
                     if msg.validMSG:
                         self.check_msg_regexs(msg, regexs, search_extensions, '')
                     else:
@@ -120,6 +245,84 @@ class AFile:
         return self.matches
 
 
+    def check_compound_file_regexs(self, regexs, search_extensions, data=None):
+        """Checks a compound file whatever its extension: as an MSG if it has the MSG properties, otherwise as TEXT like the
+        Office 97 documents in search_extensions['TEXT']"""
+
+        try:
+            msg = msmsg.MSMSG(get_readable_file(self.path) if data is None else cStringIO.StringIO(data))
+        except:
+            msg = None
+        try:
+            if msg and msg.validMSG and '__properties_version1.0' in msg.root_dir_entry.childs:
+                self.check_msg_regexs(msg, regexs, search_extensions, '')
+            elif data is None:
+                self.check_text_file_regexs(regexs)
+            else:
+                self.check_text_regexs(data, regexs, '')
+        except:
+            self.set_error(sys.exc_info()[1])
+        if msg:
+            msg.close()
+
+
+    def check_text_file_regexs(self, regexs):
+        """Checks a TEXT file in chunks, or with set_text_file_mmap on a read only memory map of the file, so the regexs
+        run on the mapped pages without copying the file. Files that can't be mapped are checked in chunks instead"""
+
+        f = open(self.path, 'rb')
+        try:
+            mapped_file = None
+            if text_file_mmap and not governor: # the governor throttles reads, so the file is read in chunks
+                try:
+                    mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (EnvironmentError, ValueError, OverflowError): # mmap.error, empty file or too big for the address space
+                    mapped_file = None
+            if mapped_file:
+                try:
+                    self.check_text_regexs(mapped_file, regexs, '')
+                finally:
+                    mapped_file.close()
+            else:
+                self.check_text_chunks_regexs(f, regexs)
+        finally:
+            f.close()
+
+
+    def check_text_chunks_regexs(self, f, regexs):
+        """Checks an open TEXT file chunk by chunk so that memory use stays flat whatever the file size. Each chunk is split at
+        a point no match can cross and the rest is carried into the next chunk, so matches across a chunk boundary are found"""
+
+        carry = ''
+        chunk_offset = 0
+        while True:
+            if governor:
+                chunk = f.read(governor.read_size)
+                governor.use_bytes(len(chunk))
+            else:
+                chunk = f.read(TEXT_FILE_CHUNK_SIZE)
+            if not chunk: # end of file
+                if carry:
+                    self.check_text_regexs(carry, regexs, '', chunk_offset)
+                break
+            if carry:
+                chunk = carry + chunk
+            split = self.get_text_split(chunk)
+            self.check_text_regexs(chunk[:split], regexs, '', chunk_offset)
+            carry = chunk[split:]
+            chunk_offset += split
+
+
+    def get_text_split(self, text):
+        """Returns the position in text to split a chunk at, looking in the last TEXT_FILE_CHUNK_OVERLAP characters. 
+        Splits after the last line break, or at the end of the text if there isn't one"""
+
+        split = text.rfind('\n', len(text) - TEXT_FILE_CHUNK_OVERLAP) + 1
+        if split == 0:
+            return len(text)
+        return split
+
+
     def check_pst_regexs(self, regexs, search_extensions, hunt_type, gauge_update_function=None):
         """ Searches a pst file for regular expressions in messages and attachments using regular expressions"""
 
@@ -131,8 +334,11 @@ class AFile:
         else:
             gauge_update_function(caption = '%s Hunt: ' % hunt_type)
 
+        if governor:
+            governor.use_file()
+
         try:
-            apst = pst.PST(self.path)
+            apst = pst.PST(self.path, governor)
             if apst.header.validPST:
 
                 total_messages = apst.get_total_message_count()
@@ -142,19 +348,7 @@ class AFile:
 
                 for folder in apst.folder_generator():
                     for message in apst.message_generator(folder):
-                        if message.Subject:
-                            message_path = os.path.join(folder.path, message.Subject)
-                        else:
-                            message_path = os.path.join(folder.path, u'[NoSubject]')
-                        if message.Body:
-                            self.check_text_regexs(message.Body, regexs, message_path)
-                        if message.HasAttachments:
-                            for subattachment in message.subattachments:
-                                if get_ext(subattachment.Filename) in search_extensions['TEXT']+search_extensions['ZIP']:
-                                    attachment = message.get_attachment(subattachment)
-                                    self.check_attachment_regexs(attachment, regexs, search_extensions, message_path)
-                                items_completed += 1
-                        items_completed += 1
+                        items_completed += self.check_pst_message_regexs(message, folder.path, regexs, search_extensions)
                         if not gauge_update_function:
                             pbar_widgets[6] = progressbar.FormatLabel(' %ss:%s' % (hunt_type, len(self.matches)))
                             pbar.update(items_completed * 100.0 / total_items)
@@ -174,6 +368,75 @@ class AFile:
         return self.matches
 
 
+    def check_pst_message_regexs(self, message, folder_path, regexs, search_extensions):
+        """Checks a pst message body and its attachments for regexs, returns the number of items (message and attachments)"""
+
+        items_completed = 1
+        if message.Subject:
+            message_path = os.path.join(folder_path, message.Subject)
+        else:
+            message_path = os.path.join(folder_path, u'[NoSubject]')
+        if message.BodyData:
+            self.check_text_regexs(message.BodyData, regexs, message_path)
+        if message.HasAttachments:
+            for subattachment in message.subattachments:
+                if get_ext(subattachment.Filename) in search_extensions['TEXT']+search_extensions['ZIP']:
+                    attachment = message.get_attachment(subattachment)
+                    self.check_attachment_regexs(attachment, regexs, search_extensions, message_path)
+                items_completed += 1
+        return items_completed
+
+
+    def get_pst_message_batches(self):
+        """Lists a pst's messages as batches of up to PST_MESSAGE_BATCH_SIZE (folder path, message nid) pairs, for
+        checking by worker processes"""
+
+        message_batches = []
+        try:
+            apst = pst.PST(self.path, governor)
+            if apst.header.validPST:
+                message_batch = []
+                for folder in apst.folder_generator():
+                    for submessage in folder.submessages:
+                        message_batch.append((folder.path, submessage.nid.nid))
+                        if len(message_batch) == PST_MESSAGE_BATCH_SIZE:
+                            message_batches.append(message_batch)
+                            message_batch = []
+                if message_batch:
+                    message_batches.append(message_batch)
+            apst.close()
+        except IOError:
+            self.set_error(sys.exc_info()[1])
+        except pst.PSTException:
+            self.set_error(sys.exc_info()[1])
+
+        return message_batches
+
+
+    def check_pst_messages_regexs(self, pst_messages, regexs, search_extensions):
+        """Checks a batch of (folder path, message nid) messages from a pst for regexs, in a worker process"""
+
+        global worker_pst
+
+        try:
+            if not worker_pst or worker_pst.fd.name != self.path:
+                if worker_pst:
+                    worker_pst.close()
+                worker_pst = None
+                worker_pst = pst.PST(self.path, governor)
+            for folder_path, nid in pst_messages:
+                try:
+                    message = pst.Message(pst.NID(nid), worker_pst.ltp, messaging=worker_pst.messaging)
+                except pst.PSTException as e:
+                    pst.log_error(e)
+                    continue
+                self.check_pst_message_regexs(message, folder_path, regexs, search_extensions)
+        except IOError:
+            self.set_error(sys.exc_info()[1])
+        except pst.PSTException:
+            self.set_error(sys.exc_info()[1])
+
+
     def check_attachment_regexs(self, attachment, regexs, search_extensions, sub_path):
         """for PST and MSG attachments, check attachment for valid extension and then regexs"""
 
@@ -196,8 +459,8 @@ class AFile:
 
     def check_msg_regexs(self, msg, regexs, search_extensions, sub_path):
 
-        if msg.Body:
-            self.check_text_regexs(msg.Body, regexs, sub_path)
+        if msg.BodyData:
+            self.check_text_regexs(msg.BodyData, regexs, sub_path)
         if msg.attachments:
             for attachment in msg.attachments:
                 self.check_attachment_regexs(attachment, regexs, search_extensions, sub_path)
@@ -210,32 +473,461 @@ class AFile:
 
         files_in_zip = [file_in_zip for file_in_zip in zf.namelist() if get_ext(file_in_zip) in all_extensions]
         for file_in_zip in files_in_zip:
-            if get_ext(file_in_zip) in search_extensions['ZIP']: # nested zip file
-                try:
-                    memory_zip = cStringIO.StringIO()
-                    memory_zip.write(zf.open(file_in_zip).read())
-                    nested_zf = zipfile.ZipFile(memory_zip)                    
-                    self.check_zip_regexs(nested_zf, regexs, search_extensions, os.path.join(sub_path, decode_zip_filename(file_in_zip)))
-                    memory_zip.close()
-                except: #RuntimeError: # e.g. zip needs password
-                    self.set_error(sys.exc_info()[1])
-            elif get_ext(file_in_zip) in search_extensions['TEXT']: #normal doc
-                try:
-                    file_text = zf.open(file_in_zip).read()
-                    self.check_text_regexs(file_text, regexs, os.path.join(sub_path, decode_zip_filename(file_in_zip)))
-                except: # RuntimeError: # e.g. zip needs password
-                    self.set_error(sys.exc_info()[1])     
-            else: # SPECIAL
+            self.check_zip_member_regexs(zf, file_in_zip, regexs, search_extensions, sub_path)
+
+
+    def check_zip_member_regexs(self, zf, file_in_zip, regexs, search_extensions, sub_path):
+        """Checks a document in a zip file for regexs"""
+
+        if get_ext(file_in_zip) in search_extensions['ZIP']: # nested zip file
+            try:
+                memory_zip = cStringIO.StringIO()
+                memory_zip.write(zf.open(file_in_zip).read())
+                nested_zf = zipfile.ZipFile(memory_zip)                    
+                self.check_zip_regexs(nested_zf, regexs, search_extensions, os.path.join(sub_path, decode_zip_filename(file_in_zip)))
+                memory_zip.close()
+            except: #RuntimeError: # e.g. zip needs password
+                self.set_error(sys.exc_info()[1])
+        elif get_ext(file_in_zip) in search_extensions['TEXT']: #normal doc
+            try:
+                file_text = zf.open(file_in_zip).read()
+                self.check_text_regexs(file_text, regexs, os.path.join(sub_path, decode_zip_filename(file_in_zip)))
+            except: # RuntimeError: # e.g. zip needs password
+                self.set_error(sys.exc_info()[1])     
+        else: # SPECIAL
+            try:
+                if get_ext(file_in_zip) == '.msg':
+                    memory_msg = cStringIO.StringIO()
+                    memory_msg.write(zf.open(file_in_zip).read())
+                    msg = msmsg.MSMSG(memory_msg)
+                    if msg.validMSG:
+                        self.check_msg_regexs(msg, regexs, search_extensions, os.path.join(sub_path, decode_zip_filename(file_in_zip)))
+                    memory_msg.close()
+            except: #RuntimeError
+                self.set_error(sys.exc_info()[1])
+
+
+    def get_zip_member_batches(self, search_extensions):
+        """Lists the documents in a zip file, and in the zip files nested in it, as batches of members holding up to 
+        ZIP_MEMBER_BATCH_SIZE uncompressed bytes, for checking by worker processes"""
+
+        member_batches = []
+        try:
+            zip_file = get_readable_file(self.path)
+            if zipfile.is_zipfile(zip_file):
+                zf = zipfile.ZipFile(zip_file)
+                member_batch = []
+                batch_size = 0
+                for member_path, file_size in get_zip_members(zf, search_extensions):
+                    if member_batch and batch_size + file_size > ZIP_MEMBER_BATCH_SIZE:
+                        member_batches.append(member_batch)
+                        member_batch = []
+                        batch_size = 0
+                    member_batch.append(member_path)
+                    batch_size += file_size
+                if member_batch:
+                    member_batches.append(member_batch)
+                zf.close()
+            else:
+                self.set_error('Invalid ZIP file')
+        except:
+            self.set_error(sys.exc_info()[1])
+
+        return member_batches
+
+
+    def check_zip_members_regexs(self, member_paths, regexs, search_extensions):
+        """Checks a batch of documents from get_zip_members for regexs, in a worker process"""
+
+        global worker_zip, worker_nested_zip
+
+        try:
+            if not worker_zip or worker_zip.filename != self.path:
+                if worker_zip:
+                    worker_zip.close()
+                worker_zip = None
+                worker_nested_zip = None
+                worker_zip = zipfile.ZipFile(get_readable_file(self.path))
+            for member_path in member_paths:
+                zip_names, file_in_zip = member_path[:-1], member_path[-1]
+                if not zip_names:
+                    self.check_zip_member_regexs(worker_zip, file_in_zip, regexs, search_extensions, '')
+                    continue
                 try:
-                    if get_ext(file_in_zip) == '.msg':
-                        memory_msg = cStringIO.StringIO()
-                        memory_msg.write(zf.open(file_in_zip).read())
-                        msg = msmsg.MSMSG(memory_msg)
-                        if msg.validMSG:
-                            self.check_msg_regexs(msg, regexs, search_extensions, os.path.join(sub_path, decode_zip_filename(file_in_zip)))
-                        memory_msg.close()
-                except: #RuntimeError
+                    if not worker_nested_zip or worker_nested_zip[0] != zip_names:
+                        worker_nested_zip = None
+                        worker_nested_zip = (zip_names, open_nested_zip(worker_zip, zip_names))
+                except: # e.g. zip needs password
                     self.set_error(sys.exc_info()[1])
+                    continue
+                sub_path = os.path.join(*[decode_zip_filename(zip_name) for zip_name in zip_names])
+                self.check_zip_member_regexs(worker_nested_zip[1], file_in_zip, regexs, search_extensions, sub_path)
+        except:
+            self.set_error(sys.exc_info()[1])
+
+
+    def get_check_parts(self, search_extensions):
+        """Splits a MAIL file into batches of messages, or a ZIP file into batches of documents, that worker processes can 
+        check separately to be merged back in order. Returns None for a file that is checked whole"""
+
+        if self.type == 'MAIL':
+            return self.get_pst_message_batches()
+        elif self.type == 'ZIP':
+            return self.get_zip_member_batches(search_extensions)
+        return None
+
+
+    def check_part_regexs(self, part, regexs, search_extensions):
+        """Checks a part from get_check_parts for regexs, in a worker process"""
+
+        if self.type == 'MAIL':
+            self.check_pst_messages_regexs(part, regexs, search_extensions)
+        elif self.type == 'ZIP':
+            self.check_zip_members_regexs(part, regexs, search_extensions)
+
+
+class TokenBucket(object):
+    """Token bucket filled at rate tokens per second up to capacity. take waits for tokens, allowing one take to go into 
+    debt so a large request waits the time its tokens take to fill rather than failing"""
+
+    def __init__(self, rate, capacity):
+
+        self.rate = rate
+        self.capacity = capacity
+        # tokens and the time they were filled, in shared memory for the I/O threads of prefetch_files and the workers of start_pool
+        self.state = multiprocessing.Array('d', [capacity, time.time()])
+
+
+    def take(self, tokens):
+
+        with self.state.get_lock():
+            now = time.time()
+            self.state[0] = min(self.capacity, self.state[0] + (now - self.state[1]) * self.rate) - tokens
+            self.state[1] = now
+            wait = -self.state[0] / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ResourceGovernor(object):
+    """Throttles a hunt to caps of bytes read and files checked per second, and to a share of one CPU by sleeping whenever
+    the hunt has used more CPU time than its share of the time since it started. A cap of 0 is no limit. The caps are
+    shared by the workers of start_pool, which each count their CPU time from start_process"""
+
+    def __init__(self, bytes_per_second=0, files_per_second=0, cpu_share=0):
+
+        self.bytes_bucket = None
+        self.read_size = TEXT_FILE_CHUNK_SIZE
+        if bytes_per_second:
+            self.bytes_bucket = TokenBucket(bytes_per_second, max(bytes_per_second * GOVERNOR_BURST_TIME, GOVERNOR_MIN_READ_SIZE))
+            # reads no bigger than a burst, so a throttled read doesn't hit the disk with one big request
+            self.read_size = int(min(self.bytes_bucket.capacity, TEXT_FILE_CHUNK_SIZE))
+        self.files_bucket = None
+        if files_per_second:
+            self.files_bucket = TokenBucket(files_per_second, max(files_per_second * GOVERNOR_BURST_TIME, 1))
+        self.cpu_share = cpu_share
+        self.cpu_time_used = multiprocessing.Value('d', 0.0)
+        self.started = time.time()
+        self.start_process()
+
+
+    def start_process(self):
+
+        self.counted_cpu_time = get_cpu_time()
+
+
+    def use_bytes(self, size):
+
+        if self.bytes_bucket:
+            self.bytes_bucket.take(size)
+        self.throttle_cpu()
+
+
+    def use_file(self):
+
+        if self.files_bucket:
+            self.files_bucket.take(1)
+        self.throttle_cpu()
+
+
+    def throttle_cpu(self):
+
+        if self.cpu_share:
+            cpu_time = get_cpu_time()
+            with self.cpu_time_used.get_lock():
+                self.cpu_time_used.value += cpu_time - self.counted_cpu_time
+                cpu_time_used = self.cpu_time_used.value
+            self.counted_cpu_time = cpu_time
+            ahead = cpu_time_used / self.cpu_share - (time.time() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+class GovernedFile(object):
+    """Read only file that takes the bytes it reads from the governor, for zipfile and msmsg to read files through"""
+
+    def __init__(self, path):
+
+        self.fd = open(path, 'rb')
+        self.name = path
+
+
+    def read(self, size=-1):
+
+        data = self.fd.read(size)
+        if governor:
+            governor.use_bytes(len(data))
+        return data
+
+
+    def seek(self, offset, whence=0):
+
+        self.fd.seek(offset, whence)
+
+
+    def tell(self):
+
+        return self.fd.tell()
+
+
+    def close(self):
+
+        self.fd.close()
+
+
+class MemoryLimitedSlots(object):
+    """Slots for the tasks of a process pool, like a semaphore of max_slots whose size follows memory use: while the 
+    resident memory of this process and its worker processes is over memory_limit the slots are halved, down to one, and
+    once it is back under MEMORY_LOW_WATER of the limit they grow again one at a time. Heavy tasks then wait their turn"""
+
+    def __init__(self, max_slots, memory_limit):
+
+        self.max_slots = max_slots
+        self.slots = max_slots
+        self.used = 0
+        self.memory_limit = memory_limit
+        self.checked = 0
+        self.condition = threading.Condition()
+
+
+    def acquire(self):
+
+        with self.condition:
+            while self.used >= self.get_slots():
+                self.condition.wait(MEMORY_CHECK_INTERVAL)
+            self.used += 1
+
+
+    def release(self):
+
+        with self.condition:
+            self.used -= 1
+            self.condition.notify()
+
+
+    def get_slots(self):
+
+        if time.time() - self.checked >= MEMORY_CHECK_INTERVAL:
+            self.checked = time.time()
+            memory_used = get_pool_memory()
+            if memory_used > self.memory_limit:
+                self.slots = max(1, self.slots / 2)
+            elif memory_used < self.memory_limit * MEMORY_LOW_WATER:
+                self.slots = min(self.max_slots, self.slots + 1)
+        return self.slots
+
+
+class PathPatterns(object):
+    """Patterns of paths compiled to be matched once per directory entry: exact paths, names that match a file or directory
+    anywhere (e.g. node_modules) and globs of names (*.tmp) or of paths (C:\\Users\\*\\AppData). A pattern with a \\ or / is
+    a path. Exact paths and names are looked up in sets and the globs are combined into a regex each for names and paths.
+    Everything is matched in lower case"""
+
+    def __init__(self, patterns=()):
+
+        self.paths = set()
+        self.names = set()
+        name_globs = []
+        path_globs = []
+        for pattern in patterns:
+            pattern = pattern.lower()
+            if not pattern:
+                continue
+            is_path = '\\' in pattern or '/' in pattern
+            if any(c in pattern for c in '*?['):
+                (path_globs if is_path else name_globs).append(fnmatch.translate(pattern))
+            elif is_path:
+                self.paths.add(pattern)
+            else:
+                self.names.add(pattern)
+        self.name_regex = re.compile('|'.join(name_globs)) if name_globs else None
+        self.path_regex = re.compile('|'.join(path_globs)) if path_globs else None
+
+
+    def __nonzero__(self):
+
+        return bool(self.paths or self.names or self.name_regex or self.path_regex)
+
+
+    def matches(self, dir, name):
+        """True if the entry name in directory dir matches a pattern. The path is only joined if there are path patterns"""
+
+        name = name.lower()
+        if name in self.names or (self.name_regex and self.name_regex.match(name)):
+            return True
+        if self.paths or self.path_regex:
+            path = os.path.join(dir, name).lower()
+            return path in self.paths or bool(self.path_regex and self.path_regex.match(path))
+        return False
+
+
+    def with_paths(self, paths):
+        """returns a copy of these patterns with more exact paths"""
+
+        path_patterns = copy.copy(self)
+        path_patterns.paths = self.paths | set(path.lower() for path in paths)
+        return path_patterns
+
+
+class PathRules(object):
+    """The rules for what a walk leaves out: directories and files matching the excluded PathPatterns, which prunes a whole
+    excluded sub directory before it is listed, files not matching the included PathPatterns if there are any, and files
+    over max_size bytes or last modified more than max_age seconds before the rules were made. With one_filesystem, 
+    directories on another device than the directory walked, e.g. mounted network shares, are left out"""
+
+    def __init__(self, excluded=(), included=(), max_size=0, max_age=0, one_filesystem=False):
+
+        self.excluded = PathPatterns(excluded)
+        self.included = PathPatterns(included)
+        self.max_size = max_size
+        self.oldest_modified = time.time() - max_age if max_age else None
+        self.one_filesystem = one_filesystem
+        self.device = None # the device of the directory walked, set by on_device
+
+
+    def excludes_dir(self, dir, name):
+
+        return self.excluded.matches(dir, name)
+
+
+    def excludes_file(self, dir, name):
+
+        return self.excluded.matches(dir, name) or (self.included and not self.included.matches(dir, name))
+
+
+    def excludes_device(self, device):
+
+        return self.device is not None and device != self.device
+
+
+    def on_device(self, root_dir):
+        """returns these rules for a walk of root_dir: with one_filesystem, a copy that leaves out other devices than
+        root_dir's, if the device isn't set already, e.g. for a coordinator's work unit. Otherwise these rules"""
+
+        if not self.one_filesystem or self.device is not None:
+            return self
+        path_rules = copy.copy(self)
+        try:
+            path_rules.device = os.stat(root_dir).st_dev
+        except OSError:
+            return self
+        return path_rules
+
+
+    def excludes_file_stats(self, afile):
+        """True if a file's stats are outside the size and age limits. Files that couldn't be stat'd are kept"""
+
+        if afile.size < 0:
+            return False
+        if self.max_size and afile.size > self.max_size:
+            return True
+        return self.oldest_modified is not None and afile.modified_ts < self.oldest_modified
+
+
+    def with_excluded_paths(self, paths):
+        """returns a copy of these rules that also excludes the exact paths"""
+
+        path_rules = copy.copy(self)
+        path_rules.excluded = self.excluded.with_paths(paths)
+        return path_rules
+
+
+class DirectoryWorkUnits(object):
+    """A coordinator's work units, which workers take in turn and keep with heartbeats. A unit is put back for another 
+    worker when it fails or its worker stops sending heartbeats"""
+
+    def __init__(self, work_units):
+
+        self.work_units = work_units
+        self.waiting = collections.deque(xrange(len(work_units)))
+        self.taken = {} # unit index: time of its worker's last heartbeat
+        self.done_units = set()
+        self.finished = False
+        self.lock = threading.Lock()
+
+
+    def take(self):
+        """returns the next waiting (unit_index, unit_dir, unit_excluded_directories), or None if none is waiting"""
+
+        with self.lock:
+            while self.waiting:
+                unit_index = self.waiting.popleft()
+                if unit_index not in self.done_units and unit_index not in self.taken:
+                    self.taken[unit_index] = time.time()
+                    return (unit_index,) + tuple(self.work_units[unit_index])
+            return None
+
+
+    def heartbeat(self, unit_index):
+
+        with self.lock:
+            if unit_index in self.taken:
+                self.taken[unit_index] = time.time()
+
+
+    def put_back(self, unit_index):
+
+        with self.lock:
+            if unit_index in self.taken:
+                del self.taken[unit_index]
+                self.waiting.append(unit_index)
+
+
+    def put_back_stale(self, timeout):
+        """puts back the units without a heartbeat for timeout seconds and returns their indexes"""
+
+        with self.lock:
+            stale_units = [unit_index for unit_index, heartbeat_time in self.taken.iteritems() if time.time() - heartbeat_time > timeout]
+            for unit_index in stale_units:
+                del self.taken[unit_index]
+                self.waiting.append(unit_index)
+            return stale_units
+
+
+    def done(self, unit_index):
+
+        with self.lock:
+            self.taken.pop(unit_index, None)
+            self.done_units.add(unit_index)
+
+
+    def finish(self):
+
+        self.finished = True
+
+
+    def is_finished(self):
+        """whether workers can stop: every unit is done or the coordinator has stopped"""
+
+        return self.finished or len(self.done_units) == len(self.work_units)
+
+
+class DirectoryWorkManager(multiprocessing.managers.BaseManager):
+    """Manager a coordinator serves its work units, queue of results and hunt settings to workers with"""
+
+DirectoryWorkManager.register('get_work_units')
+DirectoryWorkManager.register('get_result_queue')
+DirectoryWorkManager.register('get_settings')
 
 
 ###################################################################################################################################
@@ -248,69 +940,433 @@ class AFile:
 ###################################################################################################################################          
 
 
+def set_resource_limits(bytes_per_second=0, files_per_second=0, cpu_share=0):
+    """Limits the bytes read and files checked per second, and the share of one CPU used, by the hunt in this process and 
+    the workers of its process pools together. 0 is no limit"""
+
+    global governor
+
+    if bytes_per_second or files_per_second or cpu_share:
+        governor = ResourceGovernor(bytes_per_second, files_per_second, cpu_share)
+    else:
+        governor = None
+
+
+def set_memory_limit(memory_bytes):
+    """Limits the resident memory of process pools started by start_pool, by running fewer tasks at once when it is over
+    memory_bytes (see MemoryLimitedSlots) and replacing workers after MEMORY_LIMIT_TASKS_PER_WORKER tasks, so the memory 
+    a heavy task leaves behind is freed. 0 is no limit"""
+
+    global memory_limit
+
+    if memory_bytes and get_process_memory(os.getpid()) is None:
+        print colorama.Fore.YELLOW + 'Memory use can only be measured with psutil or /proc, the memory limit is ignored' + colorama.Fore.WHITE
+        memory_bytes = 0
+    memory_limit = memory_bytes
+
+
+def set_text_file_mmap(enabled):
+    """Checks TEXT files on memory maps rather than in chunks. A file truncated while it is mapped stops the hunt with
+    SIGBUS on Linux, and a mapped file can't be truncated on Windows, so it's best kept for files that aren't written to"""
+
+    global text_file_mmap
+
+    text_file_mmap = enabled
+
+
+def get_process_memory(pid):
+    """returns the resident memory in bytes of a process, 0 if it has ended, or None if it can't be measured"""
+
+    if psutil:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return 0
+    try:
+        statm = read_file('/proc/%s/statm' % pid).split()
+        return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (EnvironmentError, IndexError, ValueError):
+        if os.path.isdir('/proc/%s' % os.getpid()):
+            return 0
+        return None
+
+
+def get_pool_memory():
+    """returns the resident memory of this process and its child processes, e.g. the workers of its process pools"""
+
+    pids = [os.getpid()] + [process.pid for process in multiprocessing.active_children()]
+    return sum(get_process_memory(pid) or 0 for pid in pids)
+
+
+def start_pool(workers, worker_initializer=None, worker_initargs=()):
+    """returns a process pool of workers, set up by worker_initializer(*worker_initargs), that share this process's 
+    resource governor, and are replaced from time to time if there is a memory limit"""
+
+    tasks_per_worker = MEMORY_LIMIT_TASKS_PER_WORKER if memory_limit else None
+    return multiprocessing.Pool(workers, init_pool_worker, (governor, text_file_mmap, worker_initializer, worker_initargs), tasks_per_worker)
+
+
+def init_pool_worker(pool_governor, mmap_enabled, worker_initializer, worker_initargs):
+    """process pool initializer for start_pool"""
+
+    global governor
+
+    governor = pool_governor
+    if governor:
+        governor.start_process()
+    set_text_file_mmap(mmap_enabled)
+    if worker_initializer:
+        worker_initializer(*worker_initargs)
+
+
 def find_all_files_in_directory(AFileClass, root_dir, excluded_directories, search_extensions, gauge_update_function=None):
     """Recursively searches a directory for files. search_extensions is a dictionary of extension lists"""
     
+    if not gauge_update_function:
+        pbar_widgets = ['Doc Hunt: ', progressbar.Percentage(), ' ', progressbar.Bar(marker = progressbar.RotatingMarker()), ' ', progressbar.ETA(), progressbar.FormatLabel(' Docs:0')]
+        pbar = progressbar.ProgressBar(widgets = pbar_widgets).start()
+    else:
+        gauge_update_function(caption = 'Doc Hunt: ')
+
+    doc_files = []
+    docs_found = 0
+
+    for afile, walk_progress in walk_files_in_directory(AFileClass, root_dir, excluded_directories, search_extensions):
+        if afile:
+            doc_files.append(afile)
+            if not afile.errors:
+                docs_found += 1
+        if not gauge_update_function:
+            pbar_widgets[6] = progressbar.FormatLabel(' Docs:%s' % docs_found)
+            pbar.update(walk_progress)
+        else:
+            gauge_update_function(value = walk_progress)
+
+    if not gauge_update_function:
+        pbar.finish()
+
+    return doc_files
+
+
+def walk_files_in_directory(AFileClass, root_dir, excluded_directories, search_extensions, io_requests=0, shard=None, sniff=False, io_pool=None):
+    """Generator of (afile, walk progress %) for the files in root_dir and its sub directories with an extension in
+    search_extensions, or of None for progress between files. See find_all_regexs_in_directory for the options. A file
+    found again by its (device, inode) is given as type ALIAS with alias_of its first path. The I/O runs in io_pool if
+    given, otherwise in a pool of io_requests threads of its own"""
+
     global TEXT_FILE_SIZE_LIMIT
 
-    all_extensions = [ext for ext_list in search_extensions.values() for ext in ext_list]
+    path_rules = get_path_rules(excluded_directories).on_device(root_dir)
+    found_files = {} # (device, inode): the afile first found
+
+    all_extensions = set(ext for ext_list in search_extensions.values() for ext in ext_list)
 
     extension_types = {}
     for ext_type, ext_list in search_extensions.iteritems():
         for ext in ext_list:
             extension_types[ext] = ext_type
-    
-    if not gauge_update_function:
-        pbar_widgets = ['Doc Hunt: ', progressbar.Percentage(), ' ', progressbar.Bar(marker = progressbar.RotatingMarker()), ' ', progressbar.ETA(), progressbar.FormatLabel(' Docs:0')]
-        pbar = progressbar.ProgressBar(widgets = pbar_widgets).start()
-    else:
-        gauge_update_function(caption = 'Doc Hunt: ')
 
-    doc_files = []
     root_dir_dirs = None
     root_items_completed = 0
-    docs_found = 0
 
-    for root, sub_dirs, files in os.walk(root_dir):
-        sub_dirs[:] = [check_dir for check_dir in sub_dirs if os.path.join(root, check_dir).lower() not in excluded_directories]
-        if not root_dir_dirs:
-             root_dir_dirs = [os.path.join(root, sub_dir) for sub_dir in sub_dirs]
-             root_total_items = len(root_dir_dirs) + len(files)
-        if root in root_dir_dirs:
-            root_items_completed += 1
-            if not gauge_update_function:
-                pbar_widgets[6] = progressbar.FormatLabel(' Docs:%s' % docs_found)
-                pbar.update(root_items_completed * 100.0 / root_total_items)
+    own_io_pool = None
+    if io_requests > 0 and not io_pool:
+        io_pool = own_io_pool = multiprocessing.pool.ThreadPool(io_requests)
+
+    try:
+        for root, sub_dirs, files in walk_directory(root_dir, path_rules, io_pool, io_requests * DIRECTORY_LISTINGS_PER_THREAD):
+            if not root_dir_dirs:
+                 root_dir_dirs = [os.path.join(root, sub_dir) for sub_dir in sub_dirs]
+                 root_total_items = len(root_dir_dirs) + len(files)
+            if root in root_dir_dirs:
+                root_items_completed += 1
+                yield None, root_items_completed * 100.0 / root_total_items
+            # files are only made into AFiles once their extension, path rules, shard and type have been checked
+            files_to_check = [(filename, stat, extension_types.get(get_ext(filename))) for filename, stat in files if (sniff or get_ext(filename) in all_extensions) and not path_rules.excludes_file(root, filename)]
+            if shard:
+                files_to_check = [(filename, stat, file_type) for filename, stat, file_type in files_to_check if get_path_shard(os.path.join(root, filename), root_dir, shard[1]) == shard[0]]
+            if sniff:
+                files_to_check = sniff_files(root, files_to_check, io_pool)
+            afiles = [] # (afile, stat), with the stats of files not stat'd from the directory entry to come
+            afiles_to_stat = []
+            for filename, stat, file_type in files_to_check:
+                afile = AFileClass(filename, root) # AFile or PANFile
+                afile.type = file_type
+                if stat:
+                    afile.set_file_stats(stat)
+                else:
+                    afiles_to_stat.append(afile)
+                afiles.append((afile, stat))
+            if io_pool and len(afiles_to_stat) > 1:
+                file_stats = iter(io_pool.map(AFileClass.set_file_stats, afiles_to_stat))
             else:
-                gauge_update_function(value = root_items_completed * 100.0 / root_total_items)
-        for filename in files:
+                file_stats = (afile.set_file_stats() for afile in afiles_to_stat)
             if root == root_dir:
-                root_items_completed += 1
-            afile = AFileClass(filename, root) # AFile or PANFile
-            if afile.ext.lower() in all_extensions:
-                afile.set_file_stats()
-                afile.type = extension_types[afile.ext.lower()]
-                if afile.type in ('TEXT','SPECIAL') and afile.size > TEXT_FILE_SIZE_LIMIT:
+                root_items_completed += len(files)
+            for afile, stat in afiles:
+                if not stat:
+                    stat = next(file_stats)
+                if path_rules.excludes_file_stats(afile):
+                    continue
+                file_id = get_file_id(stat)
+                if file_id:
+                    afile.file_id = file_id
+                    if file_id in found_files:
+                        afile.set_alias(found_files[file_id].path)
+                        yield afile, root_items_completed * 100.0 / root_total_items
+                        continue
+                    found_files[file_id] = afile
+                if afile.type == 'SPECIAL' and afile.size > TEXT_FILE_SIZE_LIMIT:
                     afile.type = 'OTHER'
                     afile.set_error('File size {1} over limit of {0} for checking'.format(get_friendly_size(TEXT_FILE_SIZE_LIMIT), afile.size_friendly()))
-                doc_files.append(afile)
-                if not afile.errors:
-                    docs_found += 1
-                if not gauge_update_function:
-                    pbar_widgets[6] = progressbar.FormatLabel(' Docs:%s' % docs_found)
-                    pbar.update(root_items_completed * 100.0 / root_total_items)
+                yield afile, root_items_completed * 100.0 / root_total_items
+    finally:
+        if own_io_pool:
+            own_io_pool.terminate()
+            own_io_pool.join()
+
+
+def sniff_files(root, files, io_pool=None):
+    """Types the (filename, stat, type by extension) files in a directory by their first bytes with sniff_file_type, in 
+    io_pool's threads if there is one. Only TEXT files and files of extensions not searched are sniffed: a PST, ZIP or gzip
+    file is checked as one whatever its extension, as is a compound file (MSG) of an extension not searched, TEXT files that
+    are a known binary are left out, and so are the other files of extensions not searched"""
+
+    paths_to_sniff = [os.path.join(root, filename) for filename, stat, file_type in files if file_type in (None, 'TEXT')]
+    if io_pool and len(paths_to_sniff) > 1:
+        sniffed_types = iter(io_pool.map(sniff_file_type, paths_to_sniff))
+    else:
+        sniffed_types = (sniff_file_type(path) for path in paths_to_sniff)
+
+    sniffed_files = []
+    for filename, stat, file_type in files:
+        if file_type in (None, 'TEXT'):
+            sniffed_type = next(sniffed_types)
+            if sniffed_type in ('MAIL', 'ZIP', 'GZIP') or (sniffed_type == 'SPECIAL' and file_type is None):
+                file_type = sniffed_type
+            elif sniffed_type == 'BINARY' or file_type is None:
+                continue
+        sniffed_files.append((filename, stat, file_type))
+    return sniffed_files
+
+
+def sniff_file_type(path):
+    """returns the type of file told by its first FILE_MAGIC_SIZE bytes in FILE_MAGIC_TYPES: MAIL, ZIP, SPECIAL for a 
+    compound file, GZIP or BINARY for a file that needs no check. None if the type is unknown or the file can't be read"""
+
+    try:
+        f = open(path, 'rb')
+        try:
+            magic = f.read(FILE_MAGIC_SIZE)
+        finally:
+            f.close()
+    except IOError:
+        return None
+    for file_magic, file_type in FILE_MAGIC_TYPES:
+        if magic.startswith(file_magic):
+            return file_type
+    return None
+
+
+def walk_directory(root_dir, excluded_directories, list_pool=None, listings_ahead=0):
+    """Generator of (directory, sub directory names, files) for a directory and its sub directories, top down in the same 
+    order as os.walk and leaving out excluded_directories. files are (filename, stat) pairs, with the stat taken from the 
+    directory entry where the platform lists it with the entry (Windows), otherwise None. With a list_pool of threads, the
+    next listings_ahead directories to walk, e.g. the sibling sub directories of a wide share, are listed at the same time.
+    excluded_directories is PathRules, or a list of patterns to exclude. A directory that is the same (device, inode) as
+    one above it, a loop through a bind mount, isn't walked again"""
+
+    path_rules = get_path_rules(excluded_directories).on_device(root_dir)
+
+    dirs_to_walk = [(root_dir, None)] # a stack of (directory, parent's dir_chain), the next directory to walk is last
+    dir_listings = {}
+    while dirs_to_walk:
+        if list_pool:
+            for next_dir, parent_chain in dirs_to_walk[-listings_ahead:]:
+                if next_dir not in dir_listings:
+                    dir_listings[next_dir] = list_pool.apply_async(list_directory, (next_dir, path_rules))
+        root, parent_chain = dirs_to_walk.pop()
+        if list_pool:
+            dir_listing = dir_listings.pop(root).get()
+        else:
+            dir_listing = list_directory(root, path_rules)
+        if dir_listing is None: # unreadable directories are left out, as os.walk does
+            continue
+        dir_id, sub_dirs, linked_dirs, files = dir_listing
+        if dir_id and is_in_dir_chain(dir_id, parent_chain):
+            continue
+        dir_chain = (dir_id, parent_chain) # the ids of this directory and those above it, shared by its sub directories
+        yield root, sub_dirs, files
+        dirs_to_walk.extend((os.path.join(root, sub_dir), dir_chain) for sub_dir in reversed(sub_dirs) if sub_dir not in linked_dirs)
+
+
+def is_in_dir_chain(dir_id, dir_chain):
+    """True if dir_id is in a chain of (directory id, parent's chain) from walk_directory"""
+
+    while dir_chain:
+        if dir_chain[0] == dir_id:
+            return True
+        dir_chain = dir_chain[1]
+    return False
+
+
+def list_directory(root, path_rules):
+    """Lists a directory for walk_directory, returning its sub directory names without those path_rules exclude, the names of
+    those that are symbolic links, which are listed but not walked as os.walk does, and its files. Returns None if the 
+    directory can't be listed or is on a device path_rules exclude, with its (device, inode) id first. Uses scandir if 
+    installed, so sub directories are told from files by the directory entry rather than a stat of each"""
+
+    sub_dirs = []
+    linked_dirs = set()
+    files = []
+    try:
+        dir_stat = os.stat(root)
+        if path_rules.excludes_device(dir_stat.st_dev):
+            return None
+        if scandir:
+            for entry in scandir.scandir(root):
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not path_rules.excludes_dir(root, entry.name):
+                        sub_dirs.append(entry.name)
+                        if entry.is_symlink():
+                            linked_dirs.add(entry.name)
+                elif DIRECTORY_ENTRY_STATS:
+                    try:
+                        files.append((entry.name, entry.stat()))
+                    except OSError:
+                        files.append((entry.name, None))
                 else:
-                    gauge_update_function(value = root_items_completed * 100.0 / root_total_items)
+                    files.append((entry.name, None))
+        else:
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if os.path.isdir(path):
+                    if not path_rules.excludes_dir(root, name):
+                        sub_dirs.append(name)
+                        if os.path.islink(path):
+                            linked_dirs.add(name)
+                else:
+                    files.append((name, None))
+    except OSError:
+        return None
+    return get_file_id(dir_stat), sub_dirs, linked_dirs, files
+
+
+def find_all_regexs_in_directory(AFileClass, root_dir, excluded_directories, search_extensions, regexs, hunt_type, gauge_update_function=None, workers=1, worker_initializer=None, worker_initargs=(), io_requests=0, io_buffer_size=0, shard=None, sniff=False):
+    """Walks a directory in a thread and checks the files found for regexs, largest waiting file first, as the walk
+    carries on. One pool of io_requests threads lists directories and reads files ahead, a shard (number, count) limits the walk to
+    that shard and sniff types files by their first bytes. Returns all the files, the files checked and matches found"""
+
+    if not gauge_update_function:
+        pbar_widgets = ['%s Hunt: ' % hunt_type, progressbar.Percentage(), ' ', progressbar.Bar(marker = progressbar.RotatingMarker()), ' ', progressbar.ETA(), progressbar.FormatLabel(' Docs:0 %ss:0' % hunt_type)]
+        pbar = progressbar.ProgressBar(widgets = pbar_widgets).start()
+    else:
+        gauge_update_function(caption = '%s Hunt: ' % hunt_type)
+
+    check_types = ('TEXT','ZIP','SPECIAL','GZIP')
+    if workers > 1:
+        check_types += ('MAIL',)
+
+    io_pool = None
+    if io_requests > 0: # shared by the walk and the reads ahead, so no more than io_requests are in flight
+        io_pool = multiprocessing.pool.ThreadPool(io_requests)
+
+    all_files = []
+    walk_state = {'progress': 0.0, 'docs_found': 0, 'error': None}
+    walk_queue = Queue.PriorityQueue(WALK_QUEUE_SIZE)
+    walk_thread = threading.Thread(target=queue_files_in_directory, args=(walk_queue, walk_state, AFileClass, root_dir, excluded_directories, search_extensions, check_types), kwargs={'io_requests': io_requests, 'shard': shard, 'sniff': sniff, 'io_pool': io_pool})
+    walk_thread.daemon = True
+    walk_thread.start()
+
+    files_to_check = get_queued_files_to_check(walk_queue, all_files, walk_state, check_types)
+
+    if workers > 1:
+        checked_files = pool_check_files_regexs(files_to_check, regexs, search_extensions, workers, worker_initializer=worker_initializer, worker_initargs=worker_initargs)
+    else:
+        checked_files = check_files_regexs(files_to_check, regexs, search_extensions, io_requests=io_requests, io_buffer_size=io_buffer_size, io_pool=io_pool)
+
+    files_completed = 0
+    matches_found = 0
+
+    try:
+        for afile in checked_files:
+            matches_found += len(afile.matches)
+            files_completed += 1
+            # the walk progress scaled by how far the checks are behind the walk
+            progress = walk_state['progress'] * files_completed / max(walk_state['docs_found'], 1)
+            if not gauge_update_function:
+                pbar_widgets[6] = progressbar.FormatLabel(' Docs:%s %ss:%s' % (walk_state['docs_found'], hunt_type, matches_found))
+                pbar.update(min(progress, 100.0))
+            else:
+                gauge_update_function(value = min(progress, 100.0))
+
+        walk_thread.join()
+    finally:
+        if io_pool:
+            io_pool.terminate()
+            io_pool.join()
+    if walk_state['error']: # the walk stopped part way, so the files found are not all the files
+        raise walk_state['error'][0], walk_state['error'][1], walk_state['error'][2]
 
     if not gauge_update_function:
         pbar.finish()
 
-    return doc_files
+    return all_files, files_completed, matches_found
+
+
+def queue_files_in_directory(walk_queue, walk_state, AFileClass, root_dir, excluded_directories, search_extensions, check_types, io_requests=0, shard=None, sniff=False, io_pool=None):
+    """walker thread: puts (priority, sequence, (afile, walk progress %)) items from walk_files_in_directory on walk_queue, 
+    then a last item of None when done. Files to check are prioritised by get_check_cost, so the most expensive waiting 
+    file is taken first, and all other items go ahead of them as they are not checked. An error that stops the walk is 
+    kept in walk_state for the hunt to raise"""
 
+    sequence = 0
+    try:
+        for item in walk_files_in_directory(AFileClass, root_dir, excluded_directories, search_extensions, io_requests=io_requests, shard=shard, sniff=sniff, io_pool=io_pool):
+            afile = item[0]
+            if afile and not afile.errors and afile.type in check_types:
+                priority = -get_check_cost(afile)
+            else:
+                priority = float('-inf')
+            sequence += 1
+            walk_queue.put((priority, sequence, item))
+    except:
+        walk_state['error'] = sys.exc_info()
+    finally:
+        walk_queue.put((float('inf'), sequence + 1, None))
+
+
+def get_queued_files_to_check(walk_queue, all_files, walk_state, check_types):
+    """Generator of the files of check_types without errors taken from the walker thread's queue. Every file taken is 
+    added to all_files, and walk_state keeps the walk progress and number of files to check"""
+
+    while True:
+        item = walk_queue.get()[2]
+        if item is None:
+            return
+        afile, progress = item
+        walk_state['progress'] = max(walk_state['progress'], progress)
+        if afile:
+            all_files.append(afile)
+            if not afile.errors and afile.type in check_types:
+                walk_state['docs_found'] += 1
+                yield afile
+
+
+def get_check_cost(afile):
+    """estimated cost of checking a file, its size weighted by FILE_TYPE_COSTS, used to check the largest files first"""
+
+    return getattr(afile, 'size', 0) * FILE_TYPE_COSTS.get(afile.type, 1)
 
 
-def find_all_regexs_in_files(text_or_zip_files, regexs, search_extensions, hunt_type, gauge_update_function=None):
-    """ Searches files in doc_files list for regular expressions"""
+
+def find_all_regexs_in_files(text_or_zip_files, regexs, search_extensions, hunt_type, gauge_update_function=None, workers=1, worker_initializer=None, worker_initargs=(), io_requests=0, io_buffer_size=0):
+    """ Searches files in doc_files list for regular expressions, in a pool of worker processes largest first if workers > 1,
+    otherwise reading files ahead with io_requests threads"""
 
     if not gauge_update_function:
         pbar_widgets = ['%s Hunt: ' % hunt_type, progressbar.Percentage(), ' ', progressbar.Bar(marker = progressbar.RotatingMarker()), ' ', progressbar.ETA(), progressbar.FormatLabel(' %ss:0' % hunt_type)]
@@ -322,9 +1378,14 @@ def find_all_regexs_in_files(text_or_zip_files, regexs, search_extensions, hunt_
     files_completed = 0
     matches_found = 0
 
-    for afile in text_or_zip_files:
-        matches = afile.check_regexs(regexs, search_extensions)
-        matches_found += len(matches)
+    if workers > 1:
+        files_by_cost = sorted(text_or_zip_files, key=get_check_cost, reverse=True)
+        checked_files = pool_check_files_regexs(files_by_cost, regexs, search_extensions, workers, worker_initializer, worker_initargs)
+    else:
+        checked_files = check_files_regexs(text_or_zip_files, regexs, search_extensions, io_requests, io_buffer_size)
+
+    for afile in checked_files:
+        matches_found += len(afile.matches)
         files_completed += 1
         if not gauge_update_function:
             pbar_widgets[6] = progressbar.FormatLabel(' %ss:%s' % (hunt_type, matches_found))
@@ -338,6 +1399,128 @@ def find_all_regexs_in_files(text_or_zip_files, regexs, search_extensions, hunt_
     return total_files, matches_found
 
 
+def check_files_regexs(afiles, regexs, search_extensions, io_requests=0, io_buffer_size=0, io_pool=None):
+    """Generator that checks each file in turn, yielding it once checked. With io_requests, the files are read ahead of
+    the checks by prefetch_files"""
+
+    if io_requests > 0:
+        for afile, data in prefetch_files(afiles, io_requests, io_buffer_size, io_pool):
+            afile.check_regexs(regexs, search_extensions, data)
+            data = None
+            yield afile
+    else:
+        for afile in afiles:
+            afile.check_regexs(regexs, search_extensions)
+            yield afile
+
+
+def prefetch_files(afiles, io_requests, io_buffer_size, io_pool=None):
+    """Generator of (afile, data) in the order of afiles, with the contents of TEXT, ZIP and SPECIAL files read by a pool of 
+    io_requests threads while earlier files are checked. Up to PREFETCH_FILES_PER_REQUEST files per request and 
+    io_buffer_size bytes are read ahead. data is None for files that are left to be read when checked: MAIL files, files 
+    bigger than io_buffer_size, and files that couldn't be read so the check reports the error. The reads run in io_pool
+    if given, e.g. one shared with the walk, otherwise in a pool of io_requests threads of its own"""
+
+    own_io_pool = None
+    if not io_pool:
+        io_pool = own_io_pool = multiprocessing.pool.ThreadPool(io_requests)
+    prefetched = collections.deque() # (afile, bytes read ahead, async read or None)
+    prefetched_size = 0
+    try:
+        for afile in afiles:
+            prefetch = afile.type in ('TEXT','ZIP','SPECIAL','GZIP') and 0 <= getattr(afile, 'size', -1) <= io_buffer_size
+            read_size = afile.size if prefetch else 0
+            while prefetched and (len(prefetched) >= io_requests * PREFETCH_FILES_PER_REQUEST or prefetched_size + read_size > io_buffer_size):
+                # the buffer counts against io_buffer_size until the file's check is done and the generator resumes
+                yield get_prefetched_file(prefetched[0])
+                prefetched_size -= prefetched.popleft()[1]
+            prefetched.append((afile, read_size, io_pool.apply_async(read_governed_file, (afile.path,)) if prefetch else None))
+            prefetched_size += read_size
+        while prefetched:
+            yield get_prefetched_file(prefetched.popleft())
+    finally:
+        if own_io_pool:
+            own_io_pool.terminate()
+            own_io_pool.join()
+
+
+def get_prefetched_file(prefetched_file):
+    """waits for a file read by prefetch_files and returns (afile, data)"""
+
+    afile, read_size, async_read = prefetched_file
+    data = None
+    if async_read:
+        try:
+            data = async_read.get()
+        except EnvironmentError: # checked from the file instead, which records the error
+            data = None
+    return afile, data
+
+
+def pool_check_files_regexs(afiles, regexs, search_extensions, workers, worker_initializer=None, worker_initargs=()):
+    """Generator that checks files in a pool of worker processes set up by worker_initializer(*worker_initargs), yielding
+    each file as it is completed. MAIL and ZIP files are checked in parts that are merged back in order"""
+
+    pool = start_pool(workers, worker_initializer, worker_initargs)
+    pending_files = {}
+    if memory_limit:
+        task_slots = MemoryLimitedSlots(workers * POOL_TASKS_PER_WORKER, memory_limit)
+    else:
+        task_slots = threading.Semaphore(workers * POOL_TASKS_PER_WORKER)
+    try:
+        for i, part_index, checked_afile in pool.imap_unordered(check_file_regexs_task, get_file_regexs_tasks(afiles, regexs, search_extensions, pending_files, task_slots)):
+            task_slots.release()
+            afile, total_parts, checked_parts = pending_files[i]
+            if part_index is None:
+                afile.update(checked_afile)
+            else:
+                checked_parts[part_index] = checked_afile
+                if len(checked_parts) < total_parts:
+                    continue
+                for part_index in xrange(total_parts):
+                    afile.merge(checked_parts[part_index])
+            del pending_files[i]
+            yield afile
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def get_file_regexs_tasks(afiles, regexs, search_extensions, pending_files, task_slots):
+    """Generator of process pool tasks for afiles, which can be a list or a generator, waiting for one of the task_slots
+    before each task. pending_files keeps each file sent, with its checked parts, by its index until it is completed. A 
+    MAIL or ZIP file is listed here and sent as one task per part from get_check_parts, other files as a single task"""
+
+    for i, afile in enumerate(afiles):
+        parts = afile.get_check_parts(search_extensions)
+        if parts:
+            pending_files[i] = afile, len(parts), {}
+            for part_index, part in enumerate(parts):
+                part_afile = afile.__class__(afile.filename, afile.dir)
+                part_afile.type = afile.type
+                task_slots.acquire()
+                yield i, part_index, part_afile, regexs, search_extensions, part
+        else:
+            # a file checked whole, or a container with nothing to check that only needs completing
+            pending_files[i] = afile, 1, None
+            task_slots.acquire()
+            yield i, None, afile, regexs, search_extensions, parts
+
+
+def check_file_regexs_task(task):
+    """process pool task: checks a file, or a part of a MAIL or ZIP file, and returns it with its index and part index"""
+
+    i, part_index, afile, regexs, search_extensions, part = task
+    if part is None:
+        afile.check_regexs(regexs, search_extensions)
+    elif part:
+        afile.check_part_regexs(part, regexs, search_extensions)
+    return i, part_index, afile
+
+
 def find_all_regexs_in_psts(pst_files, regexs, search_extensions, hunt_type, gauge_update_function=None):
     """ Searches psts in pst_files list for regular expressions in messages and attachments"""
 
@@ -353,6 +1536,226 @@ def find_all_regexs_in_psts(pst_files, regexs, search_extensions, hunt_type, gau
     return total_psts, matches_found
 
 
+def coordinate_directory_work(address, authkey, root_dir, excluded_directories, settings, hunt_type, gauge_update_function=None):
+    """Coordinator: splits root_dir into work units with get_directory_work_units and serves them, with the hunt settings,
+    to workers connecting with check_directory_work to address (host, port) with authkey. Units that fail or whose worker
+    goes quiet are put back, and a unit that fails DIRECTORY_WORK_UNIT_ATTEMPTS times fails the hunt. Waits for every
+    unit's results and returns the total files searched, total matches found and all the files found, in work unit order"""
+
+    work_units = DirectoryWorkUnits(get_directory_work_units(root_dir, excluded_directories, DIRECTORY_WORK_UNIT_DEPTH))
+    result_queue = Queue.Queue()
+
+    class CoordinatorManager(DirectoryWorkManager):
+        pass
+
+    CoordinatorManager.register('get_work_units', callable=lambda: work_units)
+    CoordinatorManager.register('get_result_queue', callable=lambda: result_queue)
+    CoordinatorManager.register('get_settings', callable=lambda: settings)
+    server = CoordinatorManager(address=address, authkey=authkey).get_server()
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True # the server stops with the coordinator once all the results are in
+    server_thread.start()
+    total_units = len(work_units.work_units)
+    print colorama.Fore.WHITE + '%s Hunt coordinator on %s:%s with %s work units' % (hunt_type, server.address[0], server.address[1], total_units)
+
+    if not gauge_update_function:
+        pbar_widgets = ['%s Hunt: ' % hunt_type, progressbar.Percentage(), ' ', progressbar.Bar(marker = progressbar.RotatingMarker()), ' ', progressbar.ETA(), progressbar.FormatLabel(' Docs:0 %ss:0' % hunt_type)]
+        pbar = progressbar.ProgressBar(widgets = pbar_widgets).start()
+    else:
+        gauge_update_function(caption = '%s Hunt: ' % hunt_type)
+
+    unit_results = {}
+    unit_failures = collections.defaultdict(int)
+    total_files_searched = 0
+    total_matches_found = 0
+    try:
+        while len(unit_results) < total_units:
+            try:
+                unit_index, error, result = result_queue.get(timeout = DIRECTORY_WORK_HEARTBEAT_INTERVAL)
+            except Queue.Empty:
+                for unit_index in work_units.put_back_stale(DIRECTORY_WORK_UNIT_TIMEOUT):
+                    print colorama.Fore.YELLOW + unicode2ascii(u'Work unit %s lost its worker and was put back' % work_units.work_units[unit_index][0]) + colorama.Fore.WHITE
+                continue
+            if unit_index in unit_results:
+                continue # a unit that was put back and done twice
+            if error:
+                unit_dir = work_units.work_units[unit_index][0]
+                unit_failures[unit_index] += 1
+                if unit_failures[unit_index] >= DIRECTORY_WORK_UNIT_ATTEMPTS:
+                    raise RuntimeError(unicode2ascii(u'work unit %s failed %s times, last with:\n%s' % (unit_dir, unit_failures[unit_index], error)))
+                print colorama.Fore.YELLOW + unicode2ascii(u'Work unit %s failed and was put back:\n%s' % (unit_dir, error)) + colorama.Fore.WHITE
+                work_units.put_back(unit_index)
+                continue
+            work_units.done(unit_index)
+            files_searched, matches_found, unit_files = result
+            unit_results[unit_index] = unit_files
+            total_files_searched += files_searched
+            total_matches_found += matches_found
+            if not gauge_update_function:
+                pbar_widgets[6] = progressbar.FormatLabel(' Docs:%s %ss:%s' % (total_files_searched, hunt_type, total_matches_found))
+                pbar.update(len(unit_results) * 100.0 / total_units)
+            else:
+                gauge_update_function(value = len(unit_results) * 100.0 / total_units)
+    finally:
+        work_units.finish()
+
+    if not gauge_update_function:
+        pbar.finish()
+
+    all_files = [afile for unit_index in xrange(total_units) for afile in unit_results[unit_index]]
+    files_checked, matches_found = set_found_file_aliases(all_files)
+    return total_files_searched - files_checked, total_matches_found - matches_found, all_files
+
+
+def check_directory_work(address, authkey, settings_function, hunt_function):
+    """Worker: connects to a coordinator at address (host, port) with authkey, passes the coordinator's hunt settings to
+    settings_function, then takes work units until they are all done. hunt_function(unit_dir, unit_excluded_directories)
+    hunts a work unit and returns its files searched, matches found and all files found, which are sent back, or the error
+    if it fails. Returns the number of work units done"""
+
+    manager = DirectoryWorkManager(address=address, authkey=authkey)
+    manager.connect()
+    settings_function(manager.get_settings()._getvalue())
+    work_units = manager.get_work_units()
+    result_queue = manager.get_result_queue()
+
+    units_done = 0
+    while True:
+        try:
+            work_unit = work_units.take()
+            if not work_unit and work_units.is_finished():
+                return units_done
+        except (EOFError, IOError):
+            return units_done # the coordinator has gone, once it had all the results or gave up
+        if not work_unit:
+            time.sleep(DIRECTORY_WORK_HEARTBEAT_INTERVAL) # units taken by other workers may yet be put back
+            continue
+        unit_index, unit_dir, unit_excluded_directories = work_unit
+        heartbeat_stop = threading.Event()
+        heartbeat_thread = threading.Thread(target=send_directory_work_heartbeats, args=(work_units, unit_index, heartbeat_stop))
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+        try:
+            error, result = None, hunt_function(unit_dir, unit_excluded_directories)
+        except Exception:
+            error, result = traceback.format_exc(), None
+        finally:
+            heartbeat_stop.set()
+            heartbeat_thread.join()
+        result_queue.put((unit_index, error, result))
+        if not error:
+            units_done += 1
+
+
+def send_directory_work_heartbeats(work_units, unit_index, stop_event):
+    """heartbeat thread: tells the coordinator a worker is still hunting its work unit until stop_event is set"""
+
+    try:
+        while not stop_event.wait(DIRECTORY_WORK_HEARTBEAT_INTERVAL):
+            work_units.heartbeat(unit_index)
+    except (EOFError, IOError):
+        pass # the coordinator has gone, which the worker finds out when it sends its result
+
+
+def set_found_file_aliases(all_files):
+    """Makes the files in all_files found more than once by (device, inode), e.g. hard links checked in separate shards or
+    work units, into aliases of the first one checked, as in a single walk. Returns the number of files that had been 
+    checked and the matches they had, to take off the totals"""
+
+    first_files = {}
+    for afile in all_files:
+        file_id = getattr(afile, 'file_id', None)
+        if file_id and afile.type != 'ALIAS' and file_id not in first_files:
+            first_files[file_id] = afile
+
+    files_checked = 0
+    matches_found = 0
+    for afile in all_files:
+        first_file = first_files.get(getattr(afile, 'file_id', None))
+        if not first_file or first_file is afile:
+            continue
+        if afile.type != 'ALIAS':
+            if afile.type in ('TEXT','ZIP','SPECIAL','GZIP','MAIL'):
+                files_checked += 1
+                matches_found += len(afile.matches)
+            afile.set_alias(first_file.path)
+        else:
+            afile.alias_of = first_file.path
+    return files_checked, matches_found
+
+
+def get_directory_work_units(root_dir, excluded_directories, depth, parent_chain=None):
+    """Splits a directory into (directory, excluded directories) work units for coordinate_directory_work: each directory 
+    down to depth is a unit of only its own files, with its sub directories excluded, and each directory at depth is a unit
+    of all its files and sub directories. Symbolic links to directories, loops and other devices with one_filesystem are
+    left as the walk leaves them (see walk_directory). The excluded directories of the units are PathRules"""
+
+    path_rules = get_path_rules(excluded_directories).on_device(root_dir)
+    try:
+        dir_names = sorted(os.listdir(root_dir))
+        dir_chain = (get_file_id(os.stat(root_dir)), parent_chain)
+    except OSError:
+        dir_names = []
+    sub_dirs = [os.path.join(root_dir, dir_name) for dir_name in dir_names if not path_rules.excludes_dir(root_dir, dir_name)]
+    sub_dirs = [sub_dir for sub_dir in sub_dirs if os.path.isdir(sub_dir) and not os.path.islink(sub_dir)]
+    if depth <= 0 or not sub_dirs:
+        return [(root_dir, path_rules)]
+
+    work_units = [(root_dir, path_rules.with_excluded_paths(sub_dirs))]
+    for sub_dir in sub_dirs:
+        try:
+            sub_dir_stat = os.stat(sub_dir)
+        except OSError:
+            continue
+        sub_dir_id = get_file_id(sub_dir_stat)
+        if not path_rules.excludes_device(sub_dir_stat.st_dev) and not (sub_dir_id and is_in_dir_chain(sub_dir_id, dir_chain)):
+            work_units += get_directory_work_units(sub_dir, path_rules, depth - 1, dir_chain)
+    return work_units
+
+
+def get_path_rules(excluded_directories):
+    """returns excluded_directories as PathRules, compiling them if they're a list of patterns to exclude"""
+
+    if isinstance(excluded_directories, PathRules):
+        return excluded_directories
+    return PathRules(excluded_directories)
+
+
+def get_file_id(stat):
+    """returns the (device, inode) of a file or directory stat, which is the same for every path to it, or None where the 
+    platform doesn't give inodes (Windows) or there's no stat"""
+
+    if stat and stat.st_ino:
+        return stat.st_dev, stat.st_ino
+    return None
+
+
+def get_path_shard(path, root_dir, shard_count):
+    """returns the shard, from 1 to shard_count, of a file by an md5 hash of its path relative to root_dir in lower case 
+    with / separators, so a file is in the same shard in every run, whatever the platform or where root_dir is mounted"""
+
+    relative_path = os.path.relpath(path, root_dir).replace(os.sep, '/').lower()
+    if type(relative_path) is unicode:
+        relative_path = relative_path.encode('utf-8')
+    return int(hashlib.md5(relative_path).hexdigest()[:8], 16) % shard_count + 1
+
+
+def parse_shard(shard_string):
+    """returns (shard number, shard count) from an 'i/N' string, with i from 1 to N"""
+
+    shard_number, shard_count = [int(n) for n in shard_string.split('/')]
+    if not 1 <= shard_number <= shard_count:
+        raise ValueError('shard %s is not from 1 to %s' % (shard_number, shard_count))
+    return shard_number, shard_count
+
+
+def parse_address(address_string):
+    """returns a (host, port) address from a 'host:port' or 'port' string, the host is '' (all interfaces) if not given"""
+
+    host, sep, port = address_string.rpartition(':')
+    return host, int(port)
+
+
 ###################################################################################################################################
 #  _   _ _   _ _ _ _           _____                 _   _                 
 # | | | | |_(_) (_) |_ _   _  |  ___|   _ _ __   ___| |_(_) ___  _ __  ___ 
@@ -378,6 +1781,21 @@ def load_object(fn):
     return obj
 
 
+interned_texts = {}
+worker_pst = None # the pst open in a worker process, kept open between batches of its messages
+worker_zip = None # likewise the zip file open in a worker process
+worker_nested_zip = None # (zip names, ZipFile) of the last zip file nested in worker_zip that was opened
+governor = None # the ResourceGovernor throttling this process, see set_resource_limits
+memory_limit = 0 # see set_memory_limit
+text_file_mmap = False # see set_text_file_mmap
+
+def intern_text(text):
+    """returns a shared copy of a str or unicode string, so that directories, extensions and sub paths repeated across
+    many files are only stored once"""
+
+    return interned_texts.setdefault(text, text)
+
+
 def read_file(fn, open_mode="r"):
     f = open(fn, open_mode)
     s = f.read()
@@ -385,6 +1803,72 @@ def read_file(fn, open_mode="r"):
     return s
 
 
+def get_zip_members(zf, search_extensions, zip_names=()):
+    """returns (member path, uncompressed size) for the documents in a zip file and in the zip files nested in it, in the
+    order check_zip_regexs checks them. A member path is the names of the nested zip files down to the document. A nested
+    zip file that can't be opened is a member itself, so its check reports the error"""
+
+    all_extensions = search_extensions['TEXT'] + search_extensions['ZIP'] + search_extensions['SPECIAL']
+
+    members = []
+    for zinfo in zf.infolist():
+        if get_ext(zinfo.filename) in all_extensions:
+            member_path = zip_names + (zinfo.filename,)
+            if get_ext(zinfo.filename) in search_extensions['ZIP']:
+                try:
+                    nested_zf = open_nested_zip(zf, (zinfo.filename,))
+                except:
+                    nested_zf = None
+                if nested_zf:
+                    members.extend(get_zip_members(nested_zf, search_extensions, member_path))
+                    nested_zf.close()
+                    continue
+            members.append((member_path, zinfo.file_size))
+    return members
+
+
+def open_nested_zip(zf, zip_names):
+    """returns the zip file nested in zf by the names of the zip files down to it, read into memory"""
+
+    for zip_name in zip_names:
+        memory_zip = cStringIO.StringIO()
+        memory_zip.write(zf.open(zip_name).read())
+        zf = zipfile.ZipFile(memory_zip)
+    return zf
+
+
+def get_readable_file(path):
+    """returns a file to read through the governor if there is one, otherwise the path, for zipfile and msmsg to open"""
+
+    if governor:
+        return GovernedFile(path)
+    return path
+
+
+def read_governed_file(path):
+    """reads a whole file, in reads taken from the governor if there is one"""
+
+    if not governor:
+        return read_file(path, 'rb')
+    f = open(path, 'rb')
+    try:
+        data = []
+        while True:
+            chunk = f.read(governor.read_size)
+            if not chunk:
+                return ''.join(data)
+            governor.use_bytes(len(chunk))
+            data.append(chunk)
+    finally:
+        f.close()
+
+
+def get_cpu_time():
+    """user and system CPU time used by this process"""
+
+    return sum(os.times()[:2])
+
+
 def write_file(fn,s):
 
     f = open(fn,"w")
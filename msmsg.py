@@ -343,6 +343,15 @@ class PropertyStream:
             return None
 
 
+    def getval_data(self, prop_id):
+        """as getval, but PtypString values are returned as UTF-16-LE bytes without decoding"""
+
+        if prop_id in self.properties:
+            return getattr(self.properties[prop_id], 'data', None) or self.properties[prop_id].value
+        else:
+            return None
+
+
     def __repr__(self):
 
         return u'\n'.join([prop.__repr__() for prop in self.properties.values()])
@@ -379,6 +388,8 @@ class PropertyEntry:
                     index_stream_name = '%s-%X' % (stream_name, i)
                     value_bytes.append(parent_dir_entry.childs[index_stream_name].get_data())
                 self.value = ptype.value(value_bytes)
+            elif ptype.ptype == PTypeEnum.PtypString: # kept as UTF-16-LE bytes in data and only decoded to value when value is first used
+                self.data = bytes
             else: 
                 self.value = ptype.value(bytes)
 
@@ -387,6 +398,14 @@ class PropertyEntry:
             self.value = ptype.value(bytes[8:8+self.size])
 
 
+    def __getattr__(self, name):
+
+        if name == 'value' and 'data' in self.__dict__:
+            self.value = self.data.decode('utf-16-le') # unicode
+            return self.value
+        raise AttributeError(name)
+
+
     def __repr__(self):
 
         return u'%s=%s' % (hex(self.PropertyTag), self.value.__repr__())
@@ -710,7 +729,7 @@ class MSMSG:
         self.MessageStatus = self.prop_stream.getval(PropIdEnum.PidTagMessageStatus)
         #self.HasAttachments  = (self.MessageFlags & Message.mfHasAttach == Message.mfHasAttach)
         self.MessageSize = self.prop_stream.getval(PropIdEnum.PidTagMessageSize)
-        self.Body = self.prop_stream.getval(PropIdEnum.PidTagBody)
+        self.BodyData = self.prop_stream.getval_data(PropIdEnum.PidTagBody) # undecoded, Body is decoded when first used
         #self.Read = (self.MessageFlags & Message.mfRead == Message.mfRead)
         self.TransportMessageHeaders = self.prop_stream.getval(PropIdEnum.PidTagTransportMessageHeaders)
         self.DisplayTo = self.prop_stream.getval(PropIdEnum.PidTagDisplayToW)
@@ -787,6 +806,14 @@ class MSMSG:
         }
 
 
+    def __getattr__(self, name):
+
+        if name == 'Body':
+            self.Body = self.prop_stream.getval(PropIdEnum.PidTagBody)
+            return self.Body
+        raise AttributeError(name)
+
+
     def close(self):
 
         self.cfb.close()
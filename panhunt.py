@@ -6,7 +6,7 @@
 # PANhunt: search directories and sub directories for documents with PANs
 # By BB
 
-import os, sys, zipfile, re, datetime, cStringIO, argparse, time, hashlib, unicodedata, platform
+import os, sys, zipfile, re, datetime, cStringIO, argparse, time, hashlib, unicodedata, platform, itertools, bisect, multiprocessing
 import colorama
 import ConfigParser
 import progressbar
@@ -19,32 +19,126 @@ defaults = {
     'search_dir': u'C:\\',
     'output_file': u'panhunt_%s.txt' % time.strftime("%Y-%m-%d-%H%M%S"),
     'excluded_directories_string': u'C:\\Windows,C:\\Program Files,C:\\Program Files (x86)',
+    'included_files_string': u'',
+    'max_size_mb': 0,
+    'max_age_days': 0,
+    'sniff_file_types': False,
+    'one_filesystem': False,
+    'mmap_text_files': False,
     'text_extensions_string':  u'.doc,.xls,.xml,.txt,.csv,.log',
     'zip_extensions_string': u'.docx,.xlsx,.zip',
     'special_extensions_string': u'.msg',
     'mail_extensions_string': u'.pst',
     'other_extensions_string': u'.ost,.accdb,.mdb', # checks for existence of files that can't be checked automatically
     'excluded_pans_string': '',
+    'excluded_pans_file': '',
+    'workers': 1,
+    'coordinator': '',
+    'work_for': '',
+    'authkey': '',
+    'shard': '',
+    'max_mb_per_second': 0,
+    'max_files_per_second': 0,
+    'max_cpu_percent': 0,
+    'max_memory_mb': 0,
+    'merge_shards': '',
+    'io_requests': 0,
+    'io_buffer_mb': 64,
     'config_file': u'panhunt.ini'
 }
 search_dir = defaults['search_dir']
 output_file = defaults['output_file']
 excluded_directories_string = defaults['excluded_directories_string']
+included_files_string = defaults['included_files_string']
+max_size_mb = defaults['max_size_mb']
+max_age_days = defaults['max_age_days']
+sniff_file_types = defaults['sniff_file_types']
+one_filesystem = defaults['one_filesystem']
+mmap_text_files = defaults['mmap_text_files']
 text_extensions_string = defaults['text_extensions_string']
 zip_extensions_string = defaults['zip_extensions_string']
 special_extensions_string = defaults['special_extensions_string']
 mail_extensions_string = defaults['mail_extensions_string']
 other_extensions_string = defaults['other_extensions_string']
 excluded_pans_string = defaults['excluded_pans_string']
+excluded_pans_file = defaults['excluded_pans_file']
+workers = defaults['workers']
+io_requests = defaults['io_requests']
+io_buffer_mb = defaults['io_buffer_mb']
+coordinator = defaults['coordinator']
+work_for = defaults['work_for']
+authkey = defaults['authkey']
+shard = None
+max_mb_per_second = defaults['max_mb_per_second']
+max_files_per_second = defaults['max_files_per_second']
+max_cpu_percent = defaults['max_cpu_percent']
+max_memory_mb = defaults['max_memory_mb']
+merge_shards = defaults['merge_shards']
 config_file = defaults['config_file']
 
 excluded_directories = None
-excluded_pans = []
+excluded_pans = None
 search_extensions = {}
 
-pan_regexs = {'Mastercard': re.compile('(?:\D|^)(5[1-5][0-9]{2}(?:\ |\-|)[0-9]{4}(?:\ |\-|)[0-9]{4}(?:\ |\-|)[0-9]{4})(?:\D|$)'), \
-                'Visa': re.compile('(?:\D|^)(4[0-9]{3}(?:\ |\-|)[0-9]{4}(?:\ |\-|)[0-9]{4}(?:\ |\-|)[0-9]{4})(?:\D|$)'), \
-                'AMEX': re.compile('(?:\D|^)((?:34|37)[0-9]{2}(?:\ |\-|)[0-9]{6}(?:\ |\-|)[0-9]{5})(?:\D|$)')}
+# IIN ranges of the card schemes: brand, first and last IIN prefix of the range (of the same length), valid PAN lengths.
+# A new scheme only needs rows here. Where ranges overlap the longest prefix wins, e.g. Discover 622126-622925 in UnionPay 62
+pan_iin_ranges = (('AMEX', '34', '34', (15,)), ('AMEX', '37', '37', (15,)), \
+                ('Diners Club', '300', '305', (14, 16, 17, 18, 19)), ('Diners Club', '3095', '3095', (14, 16, 17, 18, 19)), \
+                ('Diners Club', '36', '36', (14, 16, 17, 18, 19)), ('Diners Club', '38', '39', (14, 16, 17, 18, 19)), \
+                ('Discover', '6011', '6011', (16, 17, 18, 19)), ('Discover', '644', '649', (16, 17, 18, 19)), \
+                ('Discover', '65', '65', (16, 17, 18, 19)), ('Discover', '622126', '622925', (16, 17, 18, 19)), \
+                ('JCB', '3528', '3589', (16, 17, 18, 19)), \
+                ('Maestro', '5018', '5018', (12, 13, 14, 15, 16, 17, 18, 19)), ('Maestro', '5020', '5020', (12, 13, 14, 15, 16, 17, 18, 19)), \
+                ('Maestro', '5038', '5038', (12, 13, 14, 15, 16, 17, 18, 19)), ('Maestro', '5893', '5893', (12, 13, 14, 15, 16, 17, 18, 19)), \
+                ('Maestro', '6304', '6304', (12, 13, 14, 15, 16, 17, 18, 19)), ('Maestro', '6759', '6759', (12, 13, 14, 15, 16, 17, 18, 19)), \
+                ('Maestro', '6761', '6763', (12, 13, 14, 15, 16, 17, 18, 19)), \
+                ('Mastercard', '51', '55', (16,)), ('Mastercard', '2221', '2720', (16,)), \
+                ('Mir', '2200', '2204', (16, 17, 18, 19)), \
+                ('UnionPay', '62', '62', (16, 17, 18, 19)), \
+                ('Visa', '4', '4', (13, 16, 19)))
+
+
+def compile_pan_iin_ranges(iin_ranges):
+    """returns a dictionary of (IIN prefix, PAN length): brand with every prefix in each IIN range"""
+
+    brands = {}
+    for brand, first_prefix, last_prefix, pan_lengths in iin_ranges:
+        for prefix in xrange(int(first_prefix), int(last_prefix) + 1):
+            for pan_length in pan_lengths:
+                brands[(str(prefix).zfill(len(first_prefix)), pan_length)] = brand
+    return brands
+
+
+# PAN brands by IIN prefix and PAN length, used to sort the candidates found by pan_regex
+pan_brands = compile_pan_iin_ranges(pan_iin_ranges)
+pan_brand_prefix_lengths = sorted(set(len(prefix) for prefix, pan_length in pan_brands), reverse=True)
+pan_min_length = min(pan_length for prefix, pan_length in pan_brands)
+pan_max_length = max(pan_length for prefix, pan_length in pan_brands)
+# digit positions where a space or dash separator may appear in a PAN, e.g. 4-6-5 for AMEX, otherwise 4-4-4-4
+pan_separator_positions = {14: set([4, 10]), 15: set([4, 10])}
+pan_default_separator_positions = set([4, 8, 12, 16])
+
+# translation table for finding split points in text: digits become d, separators s, nulls n and all other characters x.
+# A candidate never has an x, two nulls or two separators in a row, so text can be split after an x or inside nn or ss
+pan_split_table = ''.join(['d' if chr(i) in '0123456789' else 's' if chr(i) in ' -' else 'n' if chr(i) == '\x00' else 'x' for i in range(256)])
+
+# prefilter: text is checked in regions and a region is only scanned if, once separators and nulls (so UTF-16-LE digits
+# are contiguous) are deleted and digits translated to '0', it contains a run of '0's as long as the shortest PAN
+pan_prefilter_region_size = 262144 # 256Kb
+pan_prefilter_table = ''.join(['0' if chr(i) in '0123456789' else '.' for i in range(256)])
+pan_prefilter_deletechars = ' -\x00'
+pan_prefilter_run = '0' * pan_min_length
+
+# Luhn checksum value of each digit character, as is and doubled (the digits of the doubled digit summed)
+luhn_digits = dict((str(d), d) for d in range(10))
+luhn_doubled_digits = dict((str(d), d * 2 // 10 + d * 2 % 10) for d in range(10))
+
+# each PAN found in a file is recorded once per sub path with an occurrence count and the offsets of its first occurrences
+pan_max_offsets = 5
+
+# single pass PAN candidate scanner: runs of digits with optional space or dash separators between them, as single bytes
+# or as UTF-16-LE (e.g. legacy Office files and PST/MSG strings) where each digit and separator is followed by \x00
+pan_regex = re.compile('(?<![0-9])[0-9](?:[\ \-]?[0-9]){%s,}(?![0-9])|(?<![0-9]\x00)[0-9]\x00(?:(?:[\ \-]\x00)?[0-9]\x00){%s,}(?![0-9]\x00)' % (pan_min_length - 1, pan_min_length - 1))
 
 
 ###################################################################################################################################
@@ -60,29 +154,195 @@ pan_regexs = {'Mastercard': re.compile('(?:\D|^)(5[1-5][0-9]{2}(?:\ |\-|)[0-9]{4
 class PANFile(filehunt.AFile):
     """ PANFile: class for a file that can check itself for PANs"""
 
+    __slots__ = ('prefilter_checked', 'prefilter_passed', 'match_index')
+    result_slots = filehunt.AFile.result_slots + __slots__
+
     def __init__(self, filename, file_dir):
         
         filehunt.AFile.__init__(self, filename, file_dir)
         #self.type = None # DOC, ZIP, MAIL, SPECIAL, OTHER  
+        self.prefilter_checked = 0 # bytes seen by the prefilter
+        self.prefilter_passed = 0 # bytes let through to the PAN candidate scanner
+        self.match_index = None # (sub_path, PAN digits): PAN, created with the first match
+
+
+    def get_text_split(self, text):
+        """Splits chunks after the last character that can't be part of a PAN candidate, so no PAN crosses the split"""
+
+        return get_pan_text_split(text, len(text))
+
+
+    def check_text_regexs(self, text, regexs, sub_path, text_offset=0):
+        """Uses a single pass of the PAN candidate regular expression to check for PANs in text. The text is split into
+        regions and the prefilter skips regions that have no run of digits long enough to be a PAN. text_offset is the offset
+        of text in sub_path when it is checked in chunks"""
+
+        if isinstance(text, unicode):
+            text = text.encode('ascii', 'replace') # one byte per character so that offsets are kept and str.translate works
+        
+        text_length = len(text)
+        region_start = 0
+        while region_start < text_length:
+            region_end = min(region_start + pan_prefilter_region_size, text_length)
+            if region_end < text_length:
+                region_end = get_pan_text_split(text, region_end)
+            region = text[region_start:region_end]
+            self.prefilter_checked += len(region)
+            if pan_prefilter_run in region.translate(pan_prefilter_table, pan_prefilter_deletechars):
+                self.prefilter_passed += len(region)
+                for brand, pan, pan_offset in get_pan_candidates(text, regexs, region_start, region_end):
+                    self.add_match(sub_path, brand, pan, text_offset + pan_offset)
+            region_start = region_end
+
+
+    def set_alias(self, path):
+
+        filehunt.AFile.set_alias(self, path)
+        self.prefilter_checked = 0
+        self.prefilter_passed = 0
+        self.match_index = None
+
+
+    def merge(self, checked_afile):
+
+        filehunt.AFile.merge(self, checked_afile)
+        self.prefilter_checked += checked_afile.prefilter_checked
+        self.prefilter_passed += checked_afile.prefilter_passed
+
+
+    def merge_match(self, match):
+
+        key = (match.sub_path, match.pan.replace(' ', '').replace('-', ''))
+        if self.matches and key in self.match_index:
+            self.match_index[key].merge(match)
+        else:
+            filehunt.AFile.merge_match(self, match)
+            if self.match_index is None:
+                self.match_index = {}
+            self.match_index[key] = match
+
+
+    def add_match(self, sub_path, brand, pan, offset):
+        """Records a PAN found at offset in sub_path. Repeats of the same PAN in the same sub_path are counted on the PAN 
+        first found, so memory and the report grow with unique PANs rather than with every occurrence"""
+
+        if not self.matches:
+            self.matches = []
+            self.match_index = {}
+        key = (sub_path, pan.replace(' ', '').replace('-', ''))
+        match = self.match_index.get(key)
+        if match:
+            match.add_occurrence(offset)
+        else:
+            match = PAN(filehunt.intern_text(sub_path), brand, pan, offset)
+            self.match_index[key] = match
+            self.matches.append(match)
+
+
+class PANExclusions:
+    """PANExclusions: an index of PANs to exclude, with exact PANs (e.g. 4111111111111111), PAN prefixes such as BINs 
+    (e.g. 411111*) and prefix ranges (e.g. 411111-411119)"""
+
+    def __init__(self):
 
+        self.pans = set()
+        self.prefixes = {} # prefix length: set of prefixes
+        self.ranges = {} # prefix length: (sorted range starts, range ends), ranges merged so they don't overlap
 
-    def check_text_regexs(self, text, regexs, sub_path):
-        """Uses regular expressions to check for PANs in text"""
 
-        for brand, regex in regexs.items():
-            pans = regex.findall(text)
-            if pans:
-                for pan in pans:
-                    if PAN.is_valid_luhn_checksum(pan) and not PAN.is_excluded(pan):
-                        self.matches.append(PAN(self.path, sub_path, brand, pan))
+    def __contains__(self, pan):
 
+        digits = pan.replace(' ', '').replace('-', '')
+        if digits in self.pans:
+            return True
+        for prefix_length, prefixes in self.prefixes.iteritems():
+            if digits[:prefix_length] in prefixes:
+                return True
+        for prefix_length, (starts, ends) in self.ranges.iteritems():
+            prefix = digits[:prefix_length]
+            i = bisect.bisect_right(starts, prefix) - 1
+            if i >= 0 and len(prefix) == prefix_length and prefix <= ends[i]:
+                return True
+        return False
+
+
+    def add(self, entry):
+        """adds an exact PAN, which can be written with dashes, a prefix ending in * or a range of prefixes of the same
+        length separated by -"""
+
+        entry = entry.strip().replace(' ', '')
+        if not entry:
+            return
+        start, dash, end = entry.partition('-')
+        if dash and start.isdigit() and end.isdigit() and len(start) == len(end):
+            if start > end:
+                raise ValueError('Invalid excluded PAN range %s' % entry)
+            self.add_range(str(start), str(end))
+            return
+        digits = entry.replace('-', '')
+        if digits.endswith('*') and digits[:-1].isdigit():
+            self.prefixes.setdefault(len(digits) - 1, set()).add(str(digits[:-1]))
+        elif digits.isdigit():
+            self.pans.add(str(digits))
+        else:
+            raise ValueError('Invalid excluded PAN %s' % entry)
+
+
+    def add_range(self, start, end):
+
+        starts, ends = self.ranges.get(len(start), ([], []))
+        ranges = sorted(zip(starts, ends) + [(start, end)])
+        starts, ends = [ranges[0][0]], [ranges[0][1]]
+        for range_start, range_end in ranges[1:]:
+            if int(range_start) <= int(ends[-1]) + 1: # overlapping or adjacent
+                ends[-1] = max(ends[-1], range_end)
+            else:
+                starts.append(range_start)
+                ends.append(range_end)
+        self.ranges[len(start)] = (starts, ends)
+
+
+    def add_entries(self, entries):
 
-class PAN:
-    """PAN: A class for recording PANs, their brand and where they were found"""
+        for entry in entries:
+            try:
+                self.add(entry)
+            except ValueError:
+                print colorama.Fore.RED + filehunt.unicode2ascii(u'%s' % sys.exc_info()[1]) + colorama.Fore.WHITE
 
-    def __init__(self, path, sub_path, brand, pan):
+
+    def load_file(self, fn):
+        """loads entries from a file, one or more comma separated entries per line, with # comments"""
+
+        for line in filehunt.read_unicode_file(fn).splitlines():
+            self.add_entries(line.split('#', 1)[0].split(','))
+
+
+
+class PAN(object):
+    """PAN: A class for recording PANs, their brand and where they were found in the PANFile they belong to"""
+
+    __slots__ = ('sub_path', 'brand', 'pan', 'count', 'offsets')
+
+    def __init__(self, sub_path, brand, pan, offset=None):
         
-        self.path, self.sub_path, self.brand, self.pan = path, sub_path, brand, pan
+        self.sub_path, self.brand, self.pan = sub_path, brand, pan
+        self.count = 1
+        self.offsets = [] if offset is None else [offset] # offsets of the first pan_max_offsets occurrences
+
+
+    def add_occurrence(self, offset):
+
+        self.count += 1
+        if len(self.offsets) < pan_max_offsets:
+            self.offsets.append(offset)
+
+
+    def merge(self, other):
+        """adds the occurrences of the same PAN found later in the same sub path by another process"""
+
+        self.count += other.count
+        self.offsets.extend(other.offsets[:pan_max_offsets - len(self.offsets)])
 
 
     def __repr__(self, mask_pan=True):
@@ -91,6 +351,8 @@ class PAN:
             pan_out = self.get_masked_pan()
         else:
             pan_out = self.pan
+        if self.count > 1:
+            return '%s %s:%s (x%s)' % (self.sub_path, self.brand, pan_out, self.count)
         return '%s %s:%s' % (self.sub_path, self.brand, pan_out)
 
 
@@ -101,31 +363,27 @@ class PAN:
     @staticmethod
     def is_excluded(pan):
         global excluded_pans
-        
-        for excluded_pan in excluded_pans:
-            if pan == excluded_pan:
-                return True
-        return False
+
+        return excluded_pans is not None and pan in excluded_pans
         
     @staticmethod
     def is_valid_luhn_checksum(pan):
         """ from wikipedia: http://en.wikipedia.org/wiki/Luhn_algorithm"""
 
-        pan = re.sub('[^\d]','', pan)
+        return PAN.valid_luhn_checksums([pan])[0]
 
-        def digits_of(n):
-            return [int(d) for d in str(n)]
 
-        digits = digits_of(pan)
-        odd_digits = digits[-1::-2]
-        even_digits = digits[-2::-2]
-        checksum = 0
-        checksum += sum(odd_digits)
-        for d in even_digits:
-            checksum += sum(digits_of(d*2))
-        
-        return checksum % 10 == 0
-        
+    @staticmethod
+    def valid_luhn_checksums(pans):
+        """Luhn checks a batch of PANs in one call, returning a list of True/False. Digits are looked up in the
+        precomputed luhn_digits and luhn_doubled_digits tables rather than converted and doubled for every PAN"""
+
+        digit_value, doubled_digit_value = luhn_digits.__getitem__, luhn_doubled_digits.__getitem__
+        valid = []
+        for pan in pans:
+            digits = pan.replace(' ', '').replace('-', '')
+            valid.append((sum(map(digit_value, digits[-1::-2])) + sum(map(doubled_digit_value, digits[-2::-2]))) % 10 == 0)
+        return valid
 
 
 ###################################################################################################################################
@@ -138,6 +396,84 @@ class PAN:
 ###################################################################################################################################       
 
 
+def get_pan_brand(digits):
+    """returns the brand of a string of PAN digits from its prefix and length, or None"""
+
+    pan_length = len(digits)
+    for prefix_length in pan_brand_prefix_lengths:
+        brand = pan_brands.get((digits[:prefix_length], pan_length))
+        if brand:
+            return brand
+    return None
+
+
+def get_pan_text_split(text, end):
+    """returns the last position before end that no PAN candidate can cross: after a character that can't be part of a
+    candidate, or inside a run of nulls (e.g. the padding of binary documents) or separators. Looks back up to 
+    filehunt.TEXT_FILE_CHUNK_OVERLAP characters, returning end if there isn't one"""
+
+    tail_start = max(0, end - filehunt.TEXT_FILE_CHUNK_OVERLAP)
+    tail = text[tail_start:end].translate(pan_split_table)
+    split = max(tail.rfind('x'), tail.rfind('nn'), tail.rfind('ss')) + 1
+    if split == 0:
+        return end
+    return tail_start + split
+
+
+def get_pan_candidates(text, regex, pos=0, endpos=sys.maxint):
+    """Generator of (brand, pan, offset) for the PANs in text[pos:endpos]. The windows from get_pan_windows are Luhn
+    checked in one batch, then each run's groups are taken from left to right by the first window that passes the Luhn
+    and exclusion checks, so a window that fails them doesn't hide a PAN overlapping it"""
+
+    windows = list(get_pan_windows(text, regex, pos, endpos))
+    next_run, next_group = -1, 0
+    for (run_index, first_group, last_group, brand, pan, offset), valid in itertools.izip(windows, PAN.valid_luhn_checksums([window[4] for window in windows])):
+        if run_index != next_run:
+            next_run, next_group = run_index, 0
+        if first_group >= next_group and valid and not PAN.is_excluded(pan):
+            yield brand, pan, offset
+            next_group = last_group + 1
+
+
+def get_pan_windows(text, regex, pos=0, endpos=sys.maxint):
+    """Generator of (run index, first group, last group, brand, pan, offset) for the PAN candidates in text[pos:endpos].
+    Each run of digits found by the regex is split at its separators and every window of groups with a brand prefix, a
+    PAN length and valid separator positions is given, by first group and then last group"""
+
+    for run_index, match in enumerate(regex.finditer(text, pos, endpos)):
+        run = match.group()
+        char_size = 1
+        if run[1:2] == '\x00': # UTF-16-LE
+            run = run[::2]
+            char_size = 2
+        groups = run.replace('-', ' ').split(' ')
+        if len(groups) == 1: # no separators, so the run itself is the only window
+            if len(run) <= pan_max_length:
+                brand = get_pan_brand(run)
+                if brand:
+                    yield run_index, 0, 0, brand, run, match.start()
+            continue
+        starts = []
+        group_start = 0
+        for group in groups:
+            starts.append(group_start)
+            group_start += len(group) + 1
+        
+        for i in xrange(len(groups)):
+            digits = ''
+            separators = set()
+            for j in xrange(i, len(groups)):
+                digits += groups[j]
+                digit_count = len(digits)
+                if digit_count > pan_max_length:
+                    break
+                if digit_count >= pan_min_length and separators <= pan_separator_positions.get(digit_count, pan_default_separator_positions):
+                    brand = get_pan_brand(digits)
+                    if brand:
+                        yield run_index, i, j, brand, run[starts[i]:starts[j] + len(groups[j])], match.start() + starts[i] * char_size
+                separators.add(digit_count)
+
+
 def get_text_hash(text):
 
     if type(text) is unicode:
@@ -172,24 +508,49 @@ def check_file_hash(text_file):
 def output_report(search_dir, excluded_directories_string, all_files, total_files_searched, pans_found, output_file, mask_pans):
 
     pan_sep = u'\n\t'
+    # every path to a file found through hard links, symbolic links or bind mounts, first in order, so the report is the
+    # same whichever path was checked, e.g. in separate shards
+    file_paths = {}
+    for afile in all_files:
+        if afile.type == 'ALIAS':
+            file_paths.setdefault(afile.alias_of, []).append(afile.path)
+    for afile in all_files:
+        if afile.path in file_paths:
+            file_paths[afile.path] = sorted(file_paths[afile.path] + [afile.path], key=lambda path: path.lower())
     pan_report = u'PAN Hunt Report - %s\n%s\n' % (time.strftime("%H:%M:%S %d/%m/%Y"), '='*100)
     pan_report += u'Searched %s\nExcluded %s\n' % (search_dir, excluded_directories_string)
     pan_report += u'Command: %s\n' % (' '.join(sys.argv))
     pan_report += u'Uname: %s\n' % (' | '.join(platform.uname()))
     pan_report += u'Searched %s files. Found %s possible PANs.\n%s\n\n' % (total_files_searched, pans_found, '='*100)
     
-    for afile in sorted([afile for afile in all_files if afile.matches]):
-        pan_header = u'FOUND PANs: %s (%s %s)' % (afile.path, afile.size_friendly(), afile.modified.strftime('%d/%m/%Y'))
+    for afile_paths, afile in sorted([(file_paths.get(afile.path, [afile.path]), afile) for afile in all_files if afile.matches], key=lambda (afile_paths, afile): afile_paths[0].lower()):
+        pan_header = u'FOUND PANs: %s (%s %s)' % (afile_paths[0], afile.size_friendly(), afile.modified.strftime('%d/%m/%Y'))
         print colorama.Fore.RED + filehunt.unicode2ascii(pan_header)
         pan_report += pan_header + '\n'
         pan_list = u'\t' + pan_sep.join([pan.__repr__(mask_pans) for pan in afile.matches])
         print colorama.Fore.YELLOW + filehunt.unicode2ascii(pan_list)
-        pan_report += pan_list + '\n\n'
+        pan_report += pan_list + '\n'
+        for alias_path in afile_paths[1:]:
+            pan_report += u'\tAlso at: %s\n' % alias_path
+        pan_report += '\n'
     
     if len([afile for afile in all_files if afile.type == 'OTHER']) <> 0:
         pan_report += u'Interesting Files to check separately:\n'
-    for afile in sorted([afile for afile in all_files if afile.type == 'OTHER']):
-        pan_report += u'%s (%s %s)\n' % (afile.path, afile.size_friendly(), afile.modified.strftime('%d/%m/%Y'))
+    for afile_paths, afile in sorted([(file_paths.get(afile.path, [afile.path]), afile) for afile in all_files if afile.type == 'OTHER'], key=lambda (afile_paths, afile): afile_paths[0].lower()):
+        pan_report += u'%s (%s %s)\n' % (afile_paths[0], afile.size_friendly(), afile.modified.strftime('%d/%m/%Y'))
+        for alias_path in afile_paths[1:]:
+            pan_report += u'\tAlso at: %s\n' % alias_path
+
+    prefilter_stats = {}
+    for afile in all_files:
+        if afile.prefilter_checked:
+            ext_stats = prefilter_stats.setdefault(afile.ext.lower(), [0, 0])
+            ext_stats[0] += afile.prefilter_checked
+            ext_stats[1] += afile.prefilter_passed
+    if prefilter_stats:
+        pan_report += u'\nPrefilter bytes passed to the PAN scanner by file type:\n'
+    for ext, (prefilter_checked, prefilter_passed) in sorted(prefilter_stats.items()):
+        pan_report += u'%s %s of %s (%.1f%%)\n' % (ext, filehunt.get_friendly_size(prefilter_passed), filehunt.get_friendly_size(prefilter_checked), prefilter_passed * 100.0 / prefilter_checked)
 
     pan_report = pan_report.replace('\n', os.linesep)
 
@@ -199,7 +560,7 @@ def output_report(search_dir, excluded_directories_string, all_files, total_file
 
 def load_config_file():
   
-    global config_file, defaults, search_dir, output_file, excluded_directories_string, text_extensions_string, zip_extensions_string, special_extensions_string, mail_extensions_string, other_extensions_string, mask_pans, excluded_pans_string
+    global config_file, defaults, search_dir, output_file, excluded_directories_string, text_extensions_string, zip_extensions_string, special_extensions_string, mail_extensions_string, other_extensions_string, mask_pans, excluded_pans_string, excluded_pans_file, workers, io_requests, io_buffer_mb, authkey, max_mb_per_second, max_files_per_second, max_cpu_percent, max_memory_mb, included_files_string, max_size_mb, max_age_days, sniff_file_types, one_filesystem, mmap_text_files
 
     if not os.path.isfile(config_file):
         return
@@ -214,6 +575,12 @@ def load_config_file():
         search_dir = defaultConfig['search']
     if 'exclude' in defaultConfig and excluded_directories_string == defaults['excluded_directories_string']:
         excluded_directories_string = defaultConfig['exclude']
+    if 'include' in defaultConfig and included_files_string == defaults['included_files_string']:
+        included_files_string = defaultConfig['include']
+    if 'maxsizemb' in defaultConfig and max_size_mb == defaults['max_size_mb']:
+        max_size_mb = float(defaultConfig['maxsizemb'])
+    if 'maxagedays' in defaultConfig and max_age_days == defaults['max_age_days']:
+        max_age_days = float(defaultConfig['maxagedays'])
     if 'textfiles' in defaultConfig and text_extensions_string == defaults['text_extensions_string']:
         text_extensions_string = defaultConfig['textfiles']
     if 'zipfiles' in defaultConfig and zip_extensions_string == defaults['zip_extensions_string']:
@@ -228,33 +595,75 @@ def load_config_file():
         output_file = defaultConfig['outfile']
     if 'unmask' in defaultConfig:
         mask_pans = not (defaultConfig['unmask'].upper() == 'TRUE')
+    if 'sniff' in defaultConfig and sniff_file_types == defaults['sniff_file_types']:
+        sniff_file_types = defaultConfig['sniff'].upper() == 'TRUE'
+    if 'onefilesystem' in defaultConfig and one_filesystem == defaults['one_filesystem']:
+        one_filesystem = defaultConfig['onefilesystem'].upper() == 'TRUE'
+    if 'mmap' in defaultConfig and mmap_text_files == defaults['mmap_text_files']:
+        mmap_text_files = defaultConfig['mmap'].upper() == 'TRUE'
     if 'excludepans' in defaultConfig and excluded_pans_string == defaults['excluded_pans_string']:
         excluded_pans_string = defaultConfig['excludepans']
+    if 'excludepanfile' in defaultConfig and excluded_pans_file == defaults['excluded_pans_file']:
+        excluded_pans_file = defaultConfig['excludepanfile']
+    if 'workers' in defaultConfig and workers == defaults['workers']:
+        workers = int(defaultConfig['workers'])
+    if 'iorequests' in defaultConfig and io_requests == defaults['io_requests']:
+        io_requests = int(defaultConfig['iorequests'])
+    if 'iobuffermb' in defaultConfig and io_buffer_mb == defaults['io_buffer_mb']:
+        io_buffer_mb = int(defaultConfig['iobuffermb'])
+    if 'authkey' in defaultConfig and authkey == defaults['authkey']:
+        authkey = defaultConfig['authkey']
+    if 'maxmbps' in defaultConfig and max_mb_per_second == defaults['max_mb_per_second']:
+        max_mb_per_second = float(defaultConfig['maxmbps'])
+    if 'maxfilesps' in defaultConfig and max_files_per_second == defaults['max_files_per_second']:
+        max_files_per_second = float(defaultConfig['maxfilesps'])
+    if 'maxcpu' in defaultConfig and max_cpu_percent == defaults['max_cpu_percent']:
+        max_cpu_percent = float(defaultConfig['maxcpu'])
+    if 'maxmemorymb' in defaultConfig and max_memory_mb == defaults['max_memory_mb']:
+        max_memory_mb = int(defaultConfig['maxmemorymb'])
     
 def set_global_parameters():
 
-    global excluded_directories_string, text_extensions_string, zip_extensions_string, special_extensions_string, mail_extensions_string, other_extensions_string, excluded_directories, search_extensions, excluded_pans_string, excluded_pans
+    global excluded_directories_string, text_extensions_string, zip_extensions_string, special_extensions_string, mail_extensions_string, other_extensions_string, excluded_directories, search_extensions, excluded_pans_string, excluded_pans_file, excluded_pans, included_files_string, max_size_mb, max_age_days, one_filesystem, mmap_text_files
 
-    excluded_directories = [exc_dir.lower() for exc_dir in excluded_directories_string.split(',')]    
+    included_files = included_files_string.split(',') if included_files_string else []
+    excluded_directories = filehunt.PathRules(excluded_directories_string.split(','), included_files, max_size_mb * 1048576, max_age_days * 86400, one_filesystem)
     search_extensions['TEXT'] = text_extensions_string.split(',')
     search_extensions['ZIP'] = zip_extensions_string.split(',')
     search_extensions['SPECIAL'] = special_extensions_string.split(',')
     search_extensions['MAIL'] = mail_extensions_string.split(',')
     search_extensions['OTHER'] = other_extensions_string.split(',')
+    excluded_pans = PANExclusions()
     if len(excluded_pans_string) > 0:
-        excluded_pans = excluded_pans_string.split(',')
+        excluded_pans.add_entries(excluded_pans_string.split(','))
+    if excluded_pans_file:
+        excluded_pans.load_file(excluded_pans_file)
+    filehunt.set_resource_limits(max_mb_per_second * 1048576, max_files_per_second, max_cpu_percent / 100.0)
+    filehunt.set_memory_limit(max_memory_mb * 1048576)
+    filehunt.set_text_file_mmap(mmap_text_files)
+
+def init_pan_worker(pans_to_exclude):
+    """process pool initializer: workers that are not forked (e.g. on Windows) don't inherit the excluded PANs"""
+
+    global excluded_pans
+
+    excluded_pans = pans_to_exclude
+
 
-def hunt_pans(gauge_update_function=None):
+def hunt_pans(gauge_update_function=None, hunt_dir=None, hunt_excluded_directories=None):
 
-    global search_dir, excluded_directories, search_extensions
+    global search_dir, excluded_directories, search_extensions, excluded_pans, workers, io_requests, io_buffer_mb, shard, sniff_file_types
 
-    # find all files to check
-    all_files = filehunt.find_all_files_in_directory(PANFile, search_dir, excluded_directories, search_extensions, gauge_update_function)
+    if hunt_dir is None:
+        hunt_dir, hunt_excluded_directories = search_dir, excluded_directories
 
-    # check each file
-    total_docs, doc_pans_found = filehunt.find_all_regexs_in_files([afile for afile in all_files if not afile.errors and afile.type in ('TEXT','ZIP','SPECIAL')], pan_regexs, search_extensions, 'PAN', gauge_update_function)
-    # check each pst message and attachment
-    total_psts, pst_pans_found = filehunt.find_all_regexs_in_psts([afile for afile in all_files if not afile.errors and afile.type == 'MAIL'], pan_regexs, search_extensions, 'PAN', gauge_update_function)
+    # find all files, checking each text, zip and special file as it is found, and with workers each pst too
+    all_files, total_docs, doc_pans_found = filehunt.find_all_regexs_in_directory(PANFile, hunt_dir, hunt_excluded_directories, search_extensions, pan_regex, 'PAN', gauge_update_function,
+        workers=workers, worker_initializer=init_pan_worker, worker_initargs=(excluded_pans,), io_requests=io_requests, io_buffer_size=io_buffer_mb * 1048576, shard=shard, sniff=sniff_file_types)
+    # otherwise check each pst message and attachment once the walk is done
+    total_psts, pst_pans_found = 0, 0
+    if workers <= 1:
+        total_psts, pst_pans_found = filehunt.find_all_regexs_in_psts([afile for afile in all_files if not afile.errors and afile.type == 'MAIL'], pan_regex, search_extensions, 'PAN', gauge_update_function)
 
     total_files_searched = total_docs + total_psts
     pans_found = doc_pans_found + pst_pans_found
@@ -262,6 +671,67 @@ def hunt_pans(gauge_update_function=None):
     return total_files_searched, pans_found, all_files
 
 
+def coordinate_pan_hunt(address, authkey):
+    """hunts the search directory with workers started with --work-for, returning the results from all of them"""
+
+    global search_dir, excluded_directories, search_extensions, excluded_pans, sniff_file_types
+
+    coordinator_settings = {'search_extensions': search_extensions, 'excluded_pans': excluded_pans, 'sniff_file_types': sniff_file_types}
+    return filehunt.coordinate_directory_work(address, authkey, search_dir, excluded_directories, coordinator_settings, 'PAN')
+
+
+def save_shard(shard_file, total_files_searched, pans_found, all_files):
+    """saves the results of a --shard run, for a report on all the shards with --merge-shards"""
+
+    global search_dir, excluded_directories_string, shard
+
+    shard_results = {'search_dir': search_dir, 'excluded_directories_string': excluded_directories_string, 'shard': shard, 'total_files_searched': total_files_searched, 'pans_found': pans_found, 'all_files': all_files}
+    filehunt.save_object(shard_file, shard_results)
+
+
+def merge_shard_files(shard_files):
+    """loads the results saved by each --shard run of a search and returns them merged, as from a single run: the directory
+    searched, directories excluded, total files searched, total PANs found and all the files found"""
+
+    all_shard_results = [filehunt.load_object(shard_file) for shard_file in shard_files]
+    first_results = all_shard_results[0]
+    shard_count = first_results['shard'][1]
+    for shard_results in all_shard_results:
+        if (shard_results['search_dir'], shard_results['excluded_directories_string']) != (first_results['search_dir'], first_results['excluded_directories_string']):
+            raise ValueError('shards are from different searches: %s and %s' % (first_results['search_dir'], shard_results['search_dir']))
+    shard_numbers = sorted(shard_results['shard'] for shard_results in all_shard_results)
+    if shard_numbers != [(shard_number, shard_count) for shard_number in range(1, shard_count + 1)]:
+        raise ValueError('shards %s are not each of 1 to %s once' % (', '.join('%s/%s' % shard_number for shard_number in shard_numbers), shard_count))
+
+    total_files_searched = sum(shard_results['total_files_searched'] for shard_results in all_shard_results)
+    pans_found = sum(shard_results['pans_found'] for shard_results in all_shard_results)
+    all_files = [afile for shard_results in all_shard_results for afile in shard_results['all_files']]
+    files_checked, alias_pans_found = filehunt.set_found_file_aliases(all_files)
+    total_files_searched -= files_checked
+    pans_found -= alias_pans_found
+    return first_results['search_dir'], first_results['excluded_directories_string'], total_files_searched, pans_found, all_files
+
+
+def work_for_coordinator(address, authkey):
+
+    return filehunt.check_directory_work(address, authkey, set_coordinator_settings, hunt_pans_in_work_unit)
+
+
+def set_coordinator_settings(coordinator_settings):
+    """a worker takes the file extensions, PANs to exclude and whether to sniff file types from its coordinator"""
+
+    global search_extensions, excluded_pans, sniff_file_types
+
+    search_extensions = coordinator_settings['search_extensions']
+    excluded_pans = coordinator_settings['excluded_pans']
+    sniff_file_types = coordinator_settings['sniff_file_types']
+
+
+def hunt_pans_in_work_unit(unit_dir, unit_excluded_directories):
+
+    return hunt_pans(None, unit_dir, unit_excluded_directories)
+
+
 ###################################################################################################################################
 #  __  __       _       
 # |  \/  | __ _(_)_ __  
@@ -274,12 +744,17 @@ def hunt_pans(gauge_update_function=None):
 
 if __name__ == "__main__":
 
+    multiprocessing.freeze_support() # for worker processes in a PyInstaller executable
     colorama.init()
   
     # Command Line Arguments
     arg_parser = argparse.ArgumentParser(prog='panhunt', description='PAN Hunt v%s: search directories and sub directories for documents containing PANs.' % (app_version), formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     arg_parser.add_argument('-s', dest='search', default=search_dir, help='base directory to search in')
-    arg_parser.add_argument('-x', dest='exclude', default=excluded_directories_string, help='directories to exclude from the search')
+    arg_parser.add_argument('-x', dest='exclude', default=excluded_directories_string, help='directories and files to exclude from the search: paths, names anywhere (node_modules) or globs (*.tmp, C:\\Users\\*\\AppData)')
+    arg_parser.add_argument('--include', dest='include', default=included_files_string, help='only search files matching these names or globs (*.csv, C:\\Data\\*), comma separated')
+    arg_parser.add_argument('--max-size', dest='maxsizemb', type=float, default=max_size_mb, help='leave out files over this many MB (0 for no limit)')
+    arg_parser.add_argument('--max-age', dest='maxagedays', type=float, default=max_age_days, help='leave out files last modified more than this many days ago (0 for no limit)')
+    arg_parser.add_argument('--one-filesystem', dest='onefilesystem', action='store_true', default=False, help='don\'t search directories on other filesystems than the search directory, e.g. mounted shares')
     arg_parser.add_argument('-t', dest='textfiles', default=text_extensions_string, help='text file extensions to search')
     arg_parser.add_argument('-z', dest='zipfiles', default=zip_extensions_string, help='zip file extensions to search')
     arg_parser.add_argument('-e', dest='specialfiles', default=special_extensions_string, help='special file extensions to search')
@@ -287,8 +762,23 @@ if __name__ == "__main__":
     arg_parser.add_argument('-l', dest='otherfiles', default=other_extensions_string, help='other file extensions to list')
     arg_parser.add_argument('-o', dest='outfile', default=output_file, help='output file name for PAN report')
     arg_parser.add_argument('-u', dest='unmask', action='store_true', default=False, help='unmask PANs in output')
+    arg_parser.add_argument('--sniff', dest='sniff', action='store_true', default=False, help='also find PSTs, ZIPs, MSGs and gzip files whatever their extension by their first bytes, and leave out text files that are binaries')
     arg_parser.add_argument('-C', dest='config', default=config_file, help='configuration file to use')
-    arg_parser.add_argument('-X', dest='excludepan', default=excluded_pans_string, help='PAN to exclude from search')
+    arg_parser.add_argument('-X', dest='excludepan', default=excluded_pans_string, help='PANs, PAN prefixes (411111*) or ranges (411111-411119) to exclude from search')
+    arg_parser.add_argument('-P', dest='excludepanfile', default=excluded_pans_file, help='file of PANs, PAN prefixes or ranges to exclude from search, one or more per line')
+    arg_parser.add_argument('-w', '--workers', dest='workers', type=int, default=workers, help='number of worker processes to check files in')
+    arg_parser.add_argument('-i', '--io-requests', dest='iorequests', type=int, default=io_requests, help='number of threads to list directories and stat and read files ahead of the checks, for high latency storage (0 for none)')
+    arg_parser.add_argument('-B', '--io-buffer', dest='iobuffermb', type=int, default=io_buffer_mb, help='MB of file contents that can be read ahead of the checks')
+    arg_parser.add_argument('--mmap', dest='mmap', action='store_true', default=False, help='check text files on memory maps rather than in chunks, only for files that aren\'t being written to')
+    arg_parser.add_argument('--coordinator', dest='coordinator', default=coordinator, help='[HOST:]PORT to coordinate workers on, which hunt the search directory in sub directory work units for one report')
+    arg_parser.add_argument('--work-for', dest='workfor', default=work_for, help='HOST:PORT of a coordinator to hunt work units for, with the coordinator\'s search settings')
+    arg_parser.add_argument('--authkey', dest='authkey', default=authkey, help='shared secret for the coordinator and its workers')
+    arg_parser.add_argument('--max-mbps', dest='maxmbps', type=float, default=max_mb_per_second, help='most MB per second to read, shared by the workers (0 for no limit)')
+    arg_parser.add_argument('--max-files', dest='maxfilesps', type=float, default=max_files_per_second, help='most files per second to check, shared by the workers (0 for no limit)')
+    arg_parser.add_argument('--max-cpu', dest='maxcpu', type=float, default=max_cpu_percent, help='most percent of one CPU to use, shared by the workers (0 for no limit)')
+    arg_parser.add_argument('--max-memory', dest='maxmemorymb', type=int, default=max_memory_mb, help='MB of memory the workers can use together before fewer files are checked at once (0 for no limit)')
+    arg_parser.add_argument('--shard', dest='shard', help='I/N: only hunt the files in shard I (1 to N) by their path, and save the results to OUTFILE.shard')
+    arg_parser.add_argument('--merge-shards', dest='mergeshards', default=merge_shards, help='.shard files of each shard of a search to write one report from, comma separated')
     arg_parser.add_argument('-c', dest='checkfilehash', help=argparse.SUPPRESS) # hidden argument
 
     args = arg_parser.parse_args()    
@@ -300,19 +790,65 @@ if __name__ == "__main__":
     search_dir = unicode(args.search)
     output_file = unicode(args.outfile)
     excluded_directories_string = unicode(args.exclude)
+    included_files_string = unicode(args.include)
+    max_size_mb = args.maxsizemb
+    max_age_days = args.maxagedays
+    one_filesystem = args.onefilesystem
+    mmap_text_files = args.mmap
     text_extensions_string = unicode(args.textfiles)    
     zip_extensions_string = unicode(args.zipfiles)
     special_extensions_string = unicode(args.specialfiles)
     mail_extensions_string = unicode(args.mailfiles)
     other_extensions_string = unicode(args.otherfiles)
     mask_pans = not args.unmask
+    sniff_file_types = args.sniff
     excluded_pans_string = unicode(args.excludepan)
+    excluded_pans_file = unicode(args.excludepanfile)
+    workers = args.workers
+    io_requests = args.iorequests
+    io_buffer_mb = args.iobuffermb
+    coordinator = args.coordinator
+    work_for = args.workfor
+    authkey = args.authkey
+    merge_shards = unicode(args.mergeshards)
+    max_mb_per_second = args.maxmbps
+    max_files_per_second = args.maxfilesps
+    max_cpu_percent = args.maxcpu
+    max_memory_mb = args.maxmemorymb
+    if args.shard:
+        try:
+            shard = filehunt.parse_shard(args.shard)
+        except ValueError:
+            sys.exit('--shard should be I/N, with I from 1 to N: %s' % sys.exc_info()[1])
     config_file = unicode(args.config)
     load_config_file()
         
+    if (coordinator or work_for) and not authkey:
+        sys.exit('An --authkey is needed to coordinate or work for a coordinator')
+
     set_global_parameters()
 
-    total_files_searched, pans_found, all_files = hunt_pans()
+    if merge_shards:
+        try:
+            search_dir, excluded_directories_string, total_files_searched, pans_found, all_files = merge_shard_files(merge_shards.split(','))
+        except (IOError, ValueError):
+            sys.exit('Could not merge shards: %s' % sys.exc_info()[1])
+        output_report(search_dir, excluded_directories_string, all_files, total_files_searched, pans_found, output_file, mask_pans)
+        sys.exit()
+
+    if work_for:
+        units_done = work_for_coordinator(filehunt.parse_address(work_for), authkey)
+        print colorama.Fore.WHITE + 'Hunted %s work units for %s' % (units_done, work_for)
+        sys.exit()
+    elif coordinator:
+        try:
+            total_files_searched, pans_found, all_files = coordinate_pan_hunt(filehunt.parse_address(coordinator), authkey)
+        except RuntimeError:
+            sys.exit('Could not coordinate the hunt: %s' % sys.exc_info()[1])
+    else:
+        total_files_searched, pans_found, all_files = hunt_pans()
 
     # report findings
-    output_report(search_dir, excluded_directories_string, all_files, total_files_searched, pans_found, output_file, mask_pans)
\ No newline at end of file
+    output_report(search_dir, excluded_directories_string, all_files, total_files_searched, pans_found, output_file, mask_pans)
+    if shard:
+        save_shard(output_file + '.shard', total_files_searched, pans_found, all_files)
\ No newline at end of file
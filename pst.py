@@ -371,16 +371,19 @@ class Block:
 class NBD:
     """Node Database Layer"""
 
-    def __init__(self, fd, header):
+    def __init__(self, fd, header, governor=None):
 
         self.fd = fd
         self.header = header
+        self.governor = governor # if set, use_bytes(size) is called before each read, e.g. to throttle reads
         self.nbt_entries = self.get_page_leaf_entries(NBTENTRY, self.header.root.BREFNBT.ib)
         self.bbt_entries = self.get_page_leaf_entries(BBTENTRY, self.header.root.BREFBBT.ib)
 
 
     def fetch_page(self, offset):
 
+        if self.governor:
+            self.governor.use_bytes(Page.PAGE_SIZE)
         self.fd.seek(offset)
         return Page(self.fd.read(Page.PAGE_SIZE), self.header.is_ansi)
 
@@ -404,6 +407,8 @@ class NBD:
             block_size = data_size + block_trailer_size
         else:
             block_size = data_size + block_trailer_size + 64 - size_diff
+        if self.governor:
+            self.governor.use_bytes(block_size)
         self.fd.seek(offset)
         return Block(self.fd.read(block_size), offset, data_size, self.header.is_ansi, bid, self.header.bCryptMethod)
 
@@ -630,7 +635,7 @@ class PCBTHData:
         else:
             if NID(self.dwValueHnid).nidType == NID.NID_TYPE_HID:
                 self.hid = HID(self.dwValueHnid)
-                self.value = ptype.value(hn.get_hid_data(self.hid))
+                self.set_variable_value(ptype, hn.get_hid_data(self.hid))
             else:
                 self.subnode_nid = NID(self.dwValueHnid)
                 if self.subnode_nid.nid in hn.subnodes.keys():
@@ -638,7 +643,22 @@ class PCBTHData:
                 else:
                     raise PSTException('Invalid NID subnode reference %s' % self.subnode_nid)
                 datas = hn.ltp.nbd.fetch_all_block_data(subnode_nid_bid)
-                self.value = ptype.value(b''.join(datas))
+                self.set_variable_value(ptype, b''.join(datas))
+
+    def set_variable_value(self, ptype, bytes):
+        """PtypString values are kept as UTF-16-LE bytes in data and only decoded to value when value is first used"""
+
+        if ptype.ptype == PTypeEnum.PtypString:
+            self.data = bytes
+        else:
+            self.value = ptype.value(bytes)
+
+    def __getattr__(self, name):
+
+        if name == 'value' and 'data' in self.__dict__:
+            self.value = self.data.decode('utf-16-le') # unicode
+            return self.value
+        raise AttributeError(name)
 
     def __repr__(self):
 
@@ -919,6 +939,15 @@ class PC: # Property Context
             return None
 
 
+    def getval_data(self, propid):
+        """as getval, but PtypString values are returned as UTF-16-LE bytes without decoding"""
+
+        if propid in self.props:
+            return getattr(self.props[propid], 'data', None) or self.props[propid].value
+        else:
+            return None
+
+
     def __repr__(self):
 
         s = 'PC %s\n' % self.hn
@@ -1357,7 +1386,7 @@ class Message:
         self.MessageStatus = self.pc.getval(PropIdEnum.PidTagMessageStatus)
         self.HasAttachments  = (self.MessageFlags & Message.mfHasAttach == Message.mfHasAttach)
         self.MessageSize = self.pc.getval(PropIdEnum.PidTagMessageSize)
-        self.Body = self.pc.getval(PropIdEnum.PidTagBody)
+        self.BodyData = self.pc.getval_data(PropIdEnum.PidTagBody) # undecoded, Body is decoded when first used
         self.Read = (self.MessageFlags & Message.mfRead == Message.mfRead)
         self.TransportMessageHeaders = self.pc.getval(PropIdEnum.PidTagTransportMessageHeaders)
         self.DisplayTo = self.pc.getval(PropIdEnum.PidTagDisplayToW)
@@ -1385,6 +1414,14 @@ class Message:
                     self.tc_recipients.getval(RowIndex,PropIdEnum.PidTagEntryID)) for RowIndex in range(len(self.tc_recipients.RowIndex))]
         
 
+    def __getattr__(self, name):
+
+        if name == 'Body':
+            self.Body = self.pc.getval(PropIdEnum.PidTagBody)
+            return self.Body
+        raise AttributeError(name)
+
+
     def get_attachment(self, subattachment):
         """ fetch attachment on demand, not when Message instanced"""
             
@@ -1904,7 +1941,7 @@ class Root:
 
 class PST:
 
-    def __init__(self, pst_file):
+    def __init__(self, pst_file, governor=None):
 
         self.fd = open(pst_file,'rb')
         self.header = Header(self.fd)
@@ -1914,7 +1951,7 @@ class PST:
         if self.header.bCryptMethod not in (0,1): # unencoded or NDB_CRYPT_PERMUTE
             raise PSTException('Unsupported encoding/crypt method %s' % self.header.bCryptMethod)
 
-        self.nbd = NBD(self.fd, self.header)
+        self.nbd = NBD(self.fd, self.header, governor)
         self.ltp = LTP(self.nbd)
         self.messaging = Messaging(self.ltp)
 
@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2014, Dionach Ltd. All rights reserved. See LICENSE file.
+#
+# test_panhunt: tests of the PAN scanner, run with python -m unittest test_panhunt
+
+import unittest
+import panhunt
+
+
+def find_pans(text):
+
+    return [(brand, pan) for brand, pan, offset in panhunt.get_pan_candidates(text, panhunt.pan_regex)]
+
+
+class PANCandidateTests(unittest.TestCase):
+
+    def setUp(self):
+
+        panhunt.excluded_pans = panhunt.PANExclusions()
+
+
+    def test_pans(self):
+
+        self.assertEqual(find_pans('card 4111111111111111 and 5555 5555 5555 4444'), [('Visa', '4111111111111111'), ('Mastercard', '5555 5555 5555 4444')])
+        self.assertEqual(find_pans('amex 3782-822463-10005'), [('AMEX', '3782-822463-10005')])
+
+
+    def test_invalid_luhn_window_does_not_hide_overlapping_pan(self):
+
+        self.assertEqual(find_pans('5100 4111 1111 1111 1111'), [('Visa', '4111 1111 1111 1111')])
+        self.assertEqual(find_pans('ref 4000 5500 0000 0000 0004'), [('Mastercard', '5500 0000 0000 0004')])
+
+
+    def test_invalid_luhn(self):
+
+        self.assertEqual(find_pans('4111111111111112'), [])
+
+
+    def test_excluded_pan_does_not_hide_overlapping_pan(self):
+
+        panhunt.excluded_pans.add_entries(['4111111111111111'])
+        self.assertEqual(find_pans('4111 1111 1111 1111 5555 5555 5555 4444'), [('Mastercard', '5555 5555 5555 4444')])
+
+
+    def test_utf16(self):
+
+        self.assertEqual(find_pans('5100 4111 1111 1111 1111'.encode('utf-16-le')), [('Visa', '4111 1111 1111 1111')])
+
+
+class PANExclusionTests(unittest.TestCase):
+
+    def test_dashed_pan(self):
+
+        exclusions = panhunt.PANExclusions()
+        exclusions.add('4111-1111-1111-1111')
+        exclusions.add('3782-822463-10005')
+        self.assertTrue('4111 1111 1111 1111' in exclusions)
+        self.assertTrue('378282246310005' in exclusions)
+        self.assertFalse('4111111111111112' in exclusions)
+
+
+    def test_range(self):
+
+        exclusions = panhunt.PANExclusions()
+        exclusions.add('411111-411119')
+        self.assertTrue('4111151111111111' in exclusions)
+        self.assertFalse('4111201111111111' in exclusions)
+        self.assertRaises(ValueError, exclusions.add, '411119-411111')
+        self.assertRaises(ValueError, exclusions.add, '4111-11x1')
+
+
+class PANTextSplitTests(unittest.TestCase):
+
+    def setUp(self):
+
+        panhunt.excluded_pans = panhunt.PANExclusions()
+
+
+    def check_text(self, text):
+
+        pan_file = panhunt.PANFile(u'test.txt', u'.')
+        pan_file.check_text_regexs(text, panhunt.pan_regex, '')
+        return [(match.brand, match.pan) for match in pan_file.matches]
+
+
+    def test_utf16_pan_across_region_after_nulls(self):
+
+        self.assertEqual(self.check_text('\x00' * 262134 + ' 4111 1111 1111 1111 '.encode('utf-16-le')), [('Visa', '4111 1111 1111 1111')])
+
+
+    def test_pan_across_region_after_spaces(self):
+
+        self.assertEqual(self.check_text(' ' * 262134 + '4111 1111 1111 1111 '), [('Visa', '4111 1111 1111 1111')])
+
+
+    def test_split_inside_nulls(self):
+
+        self.assertEqual(panhunt.get_pan_text_split('\x00' * 10 + '4\x001\x00', 14), 9)
+        self.assertEqual(panhunt.get_pan_text_split('a4\x001\x00', 5), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()